@@ -0,0 +1,415 @@
+# 性能基准测试：在 code 目录下运行 python benchmark.py [名称 ...]
+import gc
+import os
+import sys
+import time
+import random
+import tempfile
+
+# 基准测试不需要真实窗口和声卡
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+
+import pygame
+
+from test import *
+
+
+# 计时工具：返回每次调用的平均毫秒数
+def time_it(func, repeat):
+    func()  # 预热
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+# 原来的绘制方式：每个图层都对所有精灵排序，并且全部绘制
+def legacy_draw(group, player):
+    group.offset.x = player.rect.centerx - SCREEN_WIDTH / 2
+    group.offset.y = player.rect.centery - SCREEN_HEIGHT / 2
+    for layer in LAYERS.values():
+        for sprite in sorted(group.sprites(), key=lambda sprite: sprite.rect.centery):
+            if sprite.z == layer:
+                offset_rect = sprite.rect.copy()
+                offset_rect.center -= group.offset
+                group.display_surface.blit(sprite.image, offset_rect)
+
+
+# 绘制：不同精灵数量下旧绘制与新绘制的单帧耗时
+def bench_draw(counts=(1000, 5000, 20000, 50000)):
+    tile = pygame.Surface((TILE_SIZE, TILE_SIZE))
+    print('sprites   legacy(ms)   culled(ms)')
+    for count in counts:
+        rng = random.Random(count)
+        group = CameraGroup()
+        side = int((count ** 0.5) * TILE_SIZE)
+        for _ in range(count):
+            pos = (rng.randrange(side), rng.randrange(side))
+            Generic(pos, tile, group, rng.choice(list(LAYERS.values())))
+        player = Generic((side // 2, side // 2), tile, group)
+        group.custom_draw(player)  # 建立索引
+        repeat = 3 if count > 10000 else 10
+        legacy = time_it(lambda: legacy_draw(group, player), repeat)
+        culled = time_it(lambda: group.custom_draw(player), repeat * 10)
+        print(f'{count:>7} {legacy:>12.2f} {culled:>12.2f}')
+
+
+# 原来的粒子：每个都新建遮罩和剪影表面，到期就丢掉
+class LegacyParticle(Generic):
+    def __init__(self, pos, surf, groups, z, duration=200):
+        super().__init__(pos, surf, groups, z)
+        self.start_time = game_clock.ticks()
+        self.duration = duration
+        new_surf = pygame.mask.from_surface(self.image).to_surface()
+        new_surf.set_colorkey((0, 0, 0))
+        self.image = new_surf
+
+    def update(self, dt):
+        if game_clock.ticks() - self.start_time > self.duration:
+            self.kill()
+
+
+# 粒子：连续 frames 帧，每帧收获一整排作物（count 个粒子），比较逐个新建和对象池
+def bench_particles(count=500, frames=120):
+    frames_surfs = import_folder(CROPS['corn']['frames']) + import_folder(CROPS['tomato']['frames'])
+    print(f'{count} particles per frame for {frames} frames')
+    for name in ('legacy', 'pooled'):
+        group = CameraGroup()
+        pool = ParticlePool(group)
+        created = 0
+        start = time.perf_counter()
+        for frame in range(frames):
+            game_clock.advance(1 / 60)
+            group.update(1 / 60)
+            for index in range(count):
+                pos = (index % 50 * TILE_SIZE, index // 50 * TILE_SIZE)
+                surf = frames_surfs[index % len(frames_surfs)]
+                if name == 'legacy':
+                    LegacyParticle(pos, surf, group, LAYERS['main'])
+                    created += 1
+                else:
+                    created += not pool.free
+                    pool.emit(pos, surf, LAYERS['main'])
+        elapsed = (time.perf_counter() - start) / frames * 1000
+        print(f'{name:>8}: {elapsed:6.2f} ms/frame, {created} particle objects created, alive {len(group)}')
+
+
+# 原来的浇水：每次都新建水瓦片（重复浇水也一样），每天全部销毁
+class LegacySoilLayer(SoilLayer):
+    def water(self, target_pos):
+        cell = self.get_cell(target_pos)
+        if cell and self.has_flag(*cell, SOIL_TILLED):
+            x, y = cell
+            self.grid[y, x] |= SOIL_WATERED
+            CountingWaterTile(self.soil_tiles[cell].rect.topleft, choice(self.water_surfs),
+                              [self.all_sprites, self.water_sprites])
+
+    def remove_water(self):
+        for sprite in self.water_sprites.sprites():
+            sprite.kill()
+        self.grid &= ~np.uint8(SOIL_WATERED)
+
+
+class CountingWaterTile(WaterTile):
+    created = 0
+
+    def __init__(self, pos, surf, groups):
+        super().__init__(pos, surf, groups)
+        CountingWaterTile.created += 1
+
+
+# 耕地和水瓦片：大农场每天每格浇两次水、第二天清掉，统计新建的水瓦片、GC 次数和 GC 停顿
+def bench_tiles(side=70, days=10):
+    pauses = []
+
+    def on_gc(phase, info):
+        if phase == 'start':
+            pauses.append(time.perf_counter())
+        else:
+            pauses[-1] = time.perf_counter() - pauses[-1]
+
+    print(f'{side * side} tilled cells, {days} days')
+    for name, layer_class in (('legacy', LegacySoilLayer), ('pooled', SoilLayer)):
+        layer = layer_class(CameraGroup(), SpatialGroup())
+        layer.water_pool.tile_class = CountingWaterTile
+        layer.grid = np.full((side, side), SOIL_FARMABLE | SOIL_TILLED, dtype=np.uint8)
+        layer.create_soil_tiles()
+        targets = [((x + 0.5) * TILE_SIZE, (y + 0.5) * TILE_SIZE) for y in range(side) for x in range(side)]
+        CountingWaterTile.created = 0
+        pauses.clear()
+        gc.collect()
+        gc.callbacks.append(on_gc)
+        start = time.perf_counter()
+        for _ in range(days):
+            for _ in range(2):
+                for pos in targets:
+                    layer.water(pos)
+            layer.all_sprites.custom_draw(layer.soil_tiles[(side // 2, side // 2)])
+            layer.remove_water()
+        elapsed = (time.perf_counter() - start) / days * 1000
+        gc.callbacks.remove(on_gc)
+        print(f'{name:>8}: {elapsed:7.1f} ms/day, {CountingWaterTile.created:>6} water tiles created, '
+              f'{len(pauses)} GC runs, {sum(pauses) * 1000:.1f} ms in GC')
+
+
+# 碰撞：大片静态碰撞区域用精灵（每个一张表面）和用位图的内存与查询耗时
+def bench_collision(side=200, density=0.3, queries=20000):
+    rng = random.Random(0)
+    blocked = [(x, y) for y in range(side) for x in range(side) if rng.random() < density]
+    rects = [pygame.Rect(rng.randrange(side * TILE_SIZE), rng.randrange(side * TILE_SIZE), 38, 56)
+             for _ in range(queries)]
+    print(f'{len(blocked)} collision tiles, {queries} queries')
+
+    start = time.perf_counter()
+    group = SpatialGroup()
+    for x, y in blocked:
+        Generic((x * TILE_SIZE, y * TILE_SIZE), pygame.Surface((TILE_SIZE, TILE_SIZE)), group)
+    group.query(rects[0])
+    built = time.perf_counter() - start
+    pixels = sum(sprite.image.get_pitch() * sprite.image.get_height() for sprite in group)
+    start = time.perf_counter()
+    hits = sum(1 for rect in rects for sprite in group.query(rect) if sprite.hitbox.colliderect(rect))
+    queried = time.perf_counter() - start
+    print(f' sprites: build {built * 1000:7.1f} ms, query {queried * 1000:6.1f} ms, '
+          f'{pixels / 1024 / 1024:.1f} MB of surfaces, {hits} hits')
+
+    start = time.perf_counter()
+    bitmap = CollisionMap(side, side)
+    for x, y in blocked:
+        bitmap.set(x, y)
+    built = time.perf_counter() - start
+    start = time.perf_counter()
+    hits = sum(1 for rect in rects for hitbox in bitmap.query(rect) if hitbox.colliderect(rect))
+    queried = time.perf_counter() - start
+    print(f'  bitmap: build {built * 1000:7.1f} ms, query {queried * 1000:6.1f} ms, '
+          f'{bitmap.memory() / 1024:.1f} KB of bits, {hits} hits')
+
+
+# 商店打开时每帧绘制加刷新的耗时：整屏重画与脏矩形，选中项每 15 帧换一次
+def bench_present(frames=600):
+    for dirty in (False, True):
+        level = Level(headless=True)
+        level.dirty_rects = dirty
+        level.toggle_shop()
+        pixels = 0
+        start = time.perf_counter()
+        for frame in range(frames):
+            if frame % 15 == 0:
+                level.menu.index = (level.menu.index + 1) % len(level.menu.options)
+            rects = level.draw()
+            if rects is None:
+                pygame.display.update()
+                pixels += SCREEN_WIDTH * SCREEN_HEIGHT
+            elif rects:
+                pygame.display.update(rects)
+                pixels += sum(rect.width * rect.height for rect in rects)
+        elapsed = (time.perf_counter() - start) / frames * 1000
+        print(f'{"dirty rects" if dirty else "full screen":>12}: {elapsed:6.2f} ms/frame, '
+              f'{pixels / frames / 1000:7.1f} k pixels pushed per frame')
+
+
+# 商店：生成大目录，测打开第一帧和上下翻动时每帧的绘制耗时（只画当前页，行表面有缓存）
+def bench_shop(frames=300):
+    level = Level(headless=True)
+    surface = pygame.display.get_surface()
+    for size in (10, 100, 1000):
+        catalog = [{'item': f'item{index}', 'label': f'物品{index}', 'category': f'分类{index % 4}',
+                    'action': ('sell', 'buy')[index % 2], 'price': index % 50 + 1} for index in range(size)]
+        for entry in catalog:
+            level.player.item_inventory[entry['item']] = 3
+        menu = Menu(level.player, level.toggle_shop, catalog)
+        start = time.perf_counter()
+        menu.display()
+        opened = (time.perf_counter() - start) * 1000
+        start = time.perf_counter()
+        for frame in range(frames):
+            menu.index = (menu.index + 1) % len(menu.options)
+            if frame % 50 == 0:
+                menu.select_category(menu.category + 1)
+            surface.fill('black')
+            menu.display()
+        elapsed = (time.perf_counter() - start) / frames * 1000
+        print(f'{size:5} items: open {opened:6.2f} ms, scroll {elapsed:6.3f} ms/frame, {len(menu.rows)} rows cached')
+        for entry in catalog:
+            del level.player.item_inventory[entry['item']]
+
+
+# 资源：种下一片作物时的磁盘读取次数与图像内存
+def bench_assets(count=500):
+    group = pygame.sprite.Group()
+    soil = pygame.Surface((TILE_SIZE, TILE_SIZE))
+    before = assets.stats()
+    start = time.perf_counter()
+    for index in range(count):
+        tile = SoilTile((index % 50 * TILE_SIZE, index // 50 * TILE_SIZE), soil, group)
+        Plant(('corn', 'tomato')[index % 2], group, tile)
+    elapsed = (time.perf_counter() - start) * 1000
+    after = assets.stats()
+    print(f'{count} plants in {elapsed:.1f} ms')
+    print(f'disk loads: {after["misses"] - before["misses"]}, cache hits: {after["hits"] - before["hits"]}')
+    print(f'cached surfaces: {after["surfaces"]}, pixel memory: {after["bytes"] / 1024:.1f} KB')
+
+
+# 启动时要加载的图像（玩家动画、耕地、作物、覆盖层和地面）
+def load_startup_assets(registry):
+    for animation in sorted(os.listdir('../graphics/character')):
+        registry.folder('../graphics/character/' + animation)
+    registry.folder_dict('../graphics/soil/')
+    registry.folder('../graphics/soil_water')
+    for plant in ('corn', 'tomato'):
+        registry.folder(f'../graphics/fruit/{plant}')
+    for name in ('hoe', 'water', 'corn', 'tomato', 'achievement_btn'):
+        registry.image(f'../graphics/overlay/{name}.png')
+    registry.load('../graphics/world/ground.png')
+
+
+# 启动：逐个文件和图集两种方式下，不用缓存、冷缓存（第一次启动）和热缓存（之后的启动）的图像加载耗时
+def bench_startup():
+    for source, atlas in (('files', None), ('atlas', load_atlas())):
+        if source == 'atlas' and atlas is None:
+            print('no atlas, run python tools.py build-atlas first')
+            continue
+        registry = AssetRegistry(atlas=atlas)
+        start = time.perf_counter()
+        load_startup_assets(registry)
+        print(f'{source} no cache: {(time.perf_counter() - start) * 1000:8.1f} ms  ({registry.reads} file reads)')
+        with tempfile.TemporaryDirectory() as directory:
+            for run in ('cold', 'warm'):
+                registry = AssetRegistry(SurfaceDiskCache(directory), atlas)
+                start = time.perf_counter()
+                load_startup_assets(registry)
+                elapsed = (time.perf_counter() - start) * 1000
+                stats = registry.stats()
+                print(f'{source} {run:>8}: {elapsed:8.1f} ms  ({stats["reads"]} file reads, '
+                      f'disk hits {stats["disk_hits"]}, misses {stats["disk_misses"]})')
+
+
+# 作物生长：大农场一天的批量生长与精灵同步耗时
+def bench_growth(count=100000):
+    side = int(count ** 0.5) + 1
+    grid = np.full((side, side), SOIL_TILLED | SOIL_PLANTED, dtype=np.uint8)
+    group = pygame.sprite.Group()
+    soil = pygame.Surface((TILE_SIZE, TILE_SIZE))
+    crops = CropField()
+    rng = random.Random(0)
+    start = time.perf_counter()
+    for index in range(count):
+        x, y = index % side, index // side
+        tile = SoilTile((x * TILE_SIZE, y * TILE_SIZE), soil, group)
+        crops.add(Plant(rng.choice(list(CROPS)), group, tile), (x, y))
+    print(f'planted {count} crops in {time.perf_counter() - start:.2f} s')
+    for day in range(1, 6):
+        # 每天随机浇一半的地
+        grid &= ~np.uint8(SOIL_WATERED)
+        grid[np.random.default_rng(day).random(grid.shape) < 0.5] |= SOIL_WATERED
+        start = time.perf_counter()
+        changed, ripe = crops.grow(grid)
+        grown = time.perf_counter() - start
+        for slot in changed:
+            crops.sprites[slot].sync(crops.age[slot])
+        synced = time.perf_counter() - start - grown
+        print(f'day {day}: grow {grown * 1000:6.1f} ms, sync {len(changed):>6} sprites {synced * 1000:7.1f} ms, '
+              f'ripe {len(ripe[0])}')
+
+
+# 存档：大农场的快照、编码写盘、读盘解码，以及读档后分帧重建精灵的耗时
+def bench_save(side=150):
+    level = Level(headless=True)
+    rng = np.random.default_rng(0)
+    grid = np.full((side, side), SOIL_FARMABLE | SOIL_TILLED, dtype=np.uint8)
+    grid[rng.random(grid.shape) < 0.5] |= SOIL_WATERED
+    cells = np.argwhere(rng.random(grid.shape) < 0.8)[:, ::-1].astype(np.int32)
+    grid[cells[:, 1], cells[:, 0]] |= SOIL_PLANTED
+    types = tuple(rng.choice(list(CROPS), len(cells)).tolist())
+    level.soil_layer.grid = np.zeros_like(grid)  # 比地图大的农场，先把网格换成同样大小
+    level.restore(WorldSnapshot(1, 200, level.player.pos, (), (), (), 0, grid, cells, rng.random(len(cells)) * 3, types))
+    print(f'{side * side} tilled cells, {len(cells)} crops')
+
+    with tempfile.TemporaryDirectory() as directory:
+        saves = SaveSystem(os.path.join(directory, 'save.bin'))
+        start = time.perf_counter()
+        snapshot = saves.snapshot(level)
+        snapped = time.perf_counter() - start
+        saves.write(snapshot)
+        written = time.perf_counter() - start - snapped
+        print(f'snapshot (main thread): {snapped * 1000:6.1f} ms, encode + write: {written * 1000:6.1f} ms, '
+              f'file {os.path.getsize(saves.path) / 1024:.1f} KB')
+
+        start = time.perf_counter()
+        snapshot = saves.load()
+        loaded = time.perf_counter() - start
+        level.restore(snapshot)
+        restored = time.perf_counter() - start - loaded
+        print(f'read + decode: {loaded * 1000:6.1f} ms, restore: {restored * 1000:6.1f} ms')
+
+    cells = len(level.soil_layer.pending)
+    frames = []
+    while level.soil_layer.pending:
+        start = time.perf_counter()
+        level.soil_layer.build_pending()
+        frames.append(time.perf_counter() - start)
+    print(f'rebuilt {cells} cells over {len(frames)} steps, worst step {max(frames) * 1000:.1f} ms, '
+          f'total {sum(frames) * 1000:.0f} ms')
+
+
+# 新一天：大农场上主线程同步推进一天，和入夜时交给模拟线程、白天分批同步精灵两种方式，主线程每步的最长耗时
+def bench_day(side=150):
+    states = []
+    for threaded in (False, True):
+        level = Level(headless=True)
+        rng = np.random.default_rng(0)
+        grid = np.full((side, side), SOIL_FARMABLE | SOIL_TILLED, dtype=np.uint8)
+        grid[rng.random(grid.shape) < 0.5] |= SOIL_WATERED
+        cells = np.argwhere(rng.random(grid.shape) < 0.8)[:, ::-1].astype(np.int32)
+        grid[cells[:, 1], cells[:, 0]] |= SOIL_PLANTED
+        types = tuple(rng.choice(list(CROPS), len(cells)).tolist())
+        level.soil_layer.grid = np.zeros_like(grid)  # 比地图大的农场，先把网格换成同样大小
+        level.restore(WorldSnapshot(1, 200, level.player.pos, (), (), (), 0, grid, cells,
+                                    rng.random(len(cells)) * 3, types))
+        level.soil_layer.build_pending(len(level.soil_layer.pending))
+        level.simulation = WorldSimulation(threaded)
+
+        start = time.perf_counter()
+        level.submit_day()
+        submitted = time.perf_counter() - start
+        if level.simulation.thread:
+            level.simulation.thread.join()  # 入夜动画期间早就算完了
+        start = time.perf_counter()
+        level.reset()
+        frames = [time.perf_counter() - start]
+        while level.soil_layer.stale or level.soil_layer.drying:
+            start = time.perf_counter()
+            level.soil_layer.sync_stale()
+            frames.append(time.perf_counter() - start)
+        print(f'{"worker" if threaded else "main thread":>11}: submit {submitted * 1000:5.1f} ms, '
+              f'new day {frames[0] * 1000:6.1f} ms, then {len(frames) - 1} steps (worst '
+              f'{max(frames[1:], default=0) * 1000:.1f} ms)')
+        plants = level.soil_layer.plant_sprites.sprites()
+        states.append((level.soil_layer.grid.tobytes(), level.soil_layer.crops.age.tobytes(),
+                       sorted((plant.slot, plant.age, plant.harvestable) for plant in plants),
+                       len(level.soil_layer.water_sprites)))
+    print('same result:', states[0] == states[1])
+
+
+BENCHMARKS = {
+    'draw': bench_draw,
+    'assets': bench_assets,
+    'startup': bench_startup,
+    'growth': bench_growth,
+    'save': bench_save,
+    'particles': bench_particles,
+    'tiles': bench_tiles,
+    'collision': bench_collision,
+    'present': bench_present,
+    'shop': bench_shop,
+    'day': bench_day,
+}
+
+if __name__ == '__main__':
+    pygame.init()
+    pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
+    sounds.enabled = False
+    for name in sys.argv[1:] or BENCHMARKS:
+        print(f'== {name} ==')
+        BENCHMARKS[name]()
@@ -1,11 +1,32 @@
+import os
+import csv
+import argparse
+import json
+import time
+import zlib
+import mmap
+import struct
+import hashlib
+import functools
+import weakref
+import threading
+from array import array
+from xml.etree import ElementTree
 import random
+import heapq
+from bisect import insort, bisect_left
+from collections import OrderedDict, deque, namedtuple
+from contextlib import nullcontext
 
 import pygame, sys
-from pytmx.util_pygame import load_pygame
+from pytmx import TiledMap, TiledTileLayer, TiledObjectGroup, TileFlags
+from pytmx.util_pygame import load_pygame, handle_transformation
 from random import randint, choice
 from pygame.math import Vector2
 from os import walk
 
+import numpy as np
+
 # 基本数值设置（做好字典方便调用）-------------------------------------------
 SCREEN_WIDTH = 1280
 SCREEN_HEIGHT = 720
@@ -31,19 +52,81 @@ LAYERS = {
     'main': 5,
     'house top': 6,
     'fruit': 7, }
-# 作物生长速度
-GROW_SPEED = {
-    'corn': 1,
-    'tomato': 0.7}
-# 商店价格
-SALE_PRICES = {
-    'wood': 4,
-    'apple': 2,
-    'corn': 10,
-    'tomato': 20}
-PURCHASE_PRICES = {
-    'corn': 4,
-    'tomato': 5}
+# 相机分块大小（像素），用于视口裁剪；不小于 CHUNK_SIZE，烘焙出的静态块才能按单元裁剪
+CAMERA_CELL_SIZE = 512
+# 静态图层烘焙开关与分块大小（像素），main 层的静态瓦片按行切条以保持遮挡关系
+BAKE_STATIC_LAYERS = True
+CHUNK_SIZE = 512
+Y_SORTED_LAYERS = {LAYERS['main']}
+# 分块流式加载：只烘焙镜头附近 STREAM_MARGIN 像素内的块，已烘焙的块超过内存预算时卸载最久没看到的
+STREAM_CHUNKS = True
+STREAM_MARGIN = 256
+STREAM_MEMORY_BUDGET = 32 * 1024 * 1024
+# 解码后图像的磁盘缓存目录
+USE_SURFACE_CACHE = True
+SURFACE_CACHE_DIR = '../cache/surfaces'
+# 地图文件（同名 .bin 为预编译的二进制地图）
+MAP_PATH = '../data/map.tmx'
+# 字体与文字渲染缓存容量
+FONT_PATH = '../font/ChangBanDianSong-12.ttf'
+TEXT_CACHE_SIZE = 256
+# 主循环：固定模拟步长（每秒 TICK_RATE 步），绘制限帧 FRAME_CAP（0 为不限），可选垂直同步
+FIXED_TIMESTEP = True
+TICK_RATE = 60
+FRAME_CAP = 60
+VSYNC = False
+MAX_FRAME_SKIP = 5
+# 全屏调色的量化步长（颜色每变化这么多才重新填充）
+TINT_QUANTUM = 4
+# 脏矩形：商店和小游戏这类几乎静止的画面只重画、只刷新变化了的区域
+DIRTY_RECTS = True
+# 帧性能分析：F3 开关 HUD（同时开关记录），F4 导出最近 PROFILER_HISTORY 帧的 trace 和 csv
+PROFILER_HISTORY = 600
+PROFILER_HUD_INTERVAL = 250
+PROFILE_DIR = '../profile'
+
+USE_ATLAS = True  # 有打包好的图集（python tools.py build-atlas）就从图集里取小图
+ATLAS_DIR = '../graphics/atlas'
+ATLAS_SOURCES = ['../graphics/character', '../graphics/soil', '../graphics/soil_water',
+                 '../graphics/fruit', '../graphics/overlay']
+ATLAS_PAGE_SIZE = 1024
+
+SAVE_PATH = '../save/save.bin'
+AUTOSAVE = True  # 每天开始时在后台线程里自动存档
+LOAD_SAVE = True  # 启动时读取存档
+REBUILD_PER_FRAME = 64  # 读档后每个模拟步最多重建多少格的耕地、水和作物精灵
+SIMULATION_WORKER = True  # 入夜时在后台线程里推进一天的作物生长，不卡住画面
+SYNC_PER_FRAME = 400  # 新一天开始后每个模拟步最多同步多少个作物精灵、收走多少块水
+
+MUSIC_PATH = '../audio/music.mp3'  # 背景音乐从磁盘流式播放，不整首解码进内存
+SOUND_CHANNELS = 8  # 音效通道池大小
+# 作物数据表（帧目录、生长速度、贴图纵向偏移），生长速度单独拿出来方便调参
+CROPS_PATH = '../data/crops.json'
+with open(CROPS_PATH, encoding='utf-8') as crops_file:
+    CROPS = json.load(crops_file)
+GROW_SPEED = {name: crop['grow_speed'] for name, crop in CROPS.items()}
+# 商店目录（物品、显示名、分类、买或卖、价格），价格表由目录生成，方便调参时原地修改
+SHOP_PATH = '../data/shop.json'
+with open(SHOP_PATH, encoding='utf-8') as shop_file:
+    SHOP_CATALOG = json.load(shop_file)
+SALE_PRICES = {entry['item']: entry['price'] for entry in SHOP_CATALOG if entry['action'] == 'sell'}
+PURCHASE_PRICES = {entry['item']: entry['price'] for entry in SHOP_CATALOG if entry['action'] == 'buy'}
+SHOP_PAGE_ROWS = 6  # 商店每页显示的行数
+# 音效表：文件、音量、优先级（通道不够时高优先级抢占低优先级）、同一音效最多同时播放几个
+SOUNDS = {
+    'hoe': ('../audio/hoe.wav', 0.1, 1, 2),
+    'water': ('../audio/water.mp3', 0.2, 1, 2),
+    'plant': ('../audio/plant.wav', 0.2, 2, 2),
+    'success': ('../audio/success.wav', 0.3, 3, 4)}
+# 耕地网格每格的状态位
+SOIL_FARMABLE = 1
+SOIL_TILLED = 2
+SOIL_WATERED = 4
+SOIL_PLANTED = 8
+SOIL_HARVESTABLE = 16
+# 耕地自动拼接：上右下左四个邻居组成位掩码（上1 右2 下4 左8），查表得到贴图名
+SOIL_AUTOTILE = ['o', 'b', 'l', 'bl', 't', 'tb', 'tl', 'tbr',
+                 'r', 'br', 'lr', 'lrb', 'tr', 'tbl', 'lrt', 'x']
 
 
 # 覆盖层(静止部分）的显示------------------------------------------------------
@@ -53,17 +136,14 @@ class Overlay:
         self.player = player
         self.get_day = get_day_func  # 新增获取天数的方法
         overlay_path = '../graphics/overlay/'
-        self.tools_surf = {tool: pygame.image.load(f'{overlay_path}{tool}.png').convert_alpha() for tool in
-                           player.tools}
-        self.seeds_surf = {seed: pygame.image.load(f'{overlay_path}{seed}.png').convert_alpha() for seed in
-                           player.seeds}
-        self.achievement_btn_surf = pygame.image.load(f'{overlay_path}achievement_btn.png').convert_alpha()
-        self.day_font = pygame.font.Font('../font/ChangBanDianSong-12.ttf', 28)  # 新增字体
+        self.tools_surf = {tool: assets.image(f'{overlay_path}{tool}.png') for tool in player.tools}
+        self.seeds_surf = {seed: assets.image(f'{overlay_path}{seed}.png') for seed in player.seeds}
+        self.achievement_btn_surf = assets.image(f'{overlay_path}achievement_btn.png')
 
     def display(self):
         # 显示天数
         day = self.get_day()
-        day_surf = self.day_font.render(f'第 {day} 天', True, (38, 101, 189))
+        day_surf = text_cache.render(f'第 {day} 天', (38, 101, 189), 28)
         self.display_surface.blit(day_surf, (20, 20))
 
         # 工具
@@ -79,27 +159,814 @@ class Overlay:
         self.display_surface.blit(self.achievement_btn_surf, achievement_btn_rect)
 
 
+# 磁盘缓存：把解码后的像素以原始 RGBA 格式存下来，下次启动直接内存映射读取--------
+# 缓存文件名由源文件路径、修改时间和大小决定，源图一改动旧缓存自然失效
+class SurfaceDiskCache:
+    header = struct.Struct('<4sII')  # 魔数、宽、高
+    magic = b'KSRF'
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.hits = 0
+        self.misses = 0
+
+    def entry_path(self, path):
+        stat = os.stat(path)
+        key = f'{os.path.abspath(path)}|{stat.st_mtime_ns}|{stat.st_size}'
+        return os.path.join(self.directory, hashlib.sha1(key.encode('utf-8')).hexdigest() + '.raw')
+
+    def load(self, path):
+        entry = self.entry_path(path)
+        try:
+            with open(entry, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                magic, width, height = self.header.unpack_from(data)
+                if magic != self.magic or len(data) != self.header.size + width * height * 4:
+                    raise ValueError(entry)
+                with memoryview(data)[self.header.size:] as pixels:
+                    raw = pygame.image.frombuffer(pixels, (width, height), 'RGBA')
+                    surf = raw.convert_alpha()
+                    del raw
+        except (OSError, ValueError):
+            self.misses += 1
+            surf = pygame.image.load(path)
+            self.store(entry, surf)
+            return surf.convert_alpha()
+        self.hits += 1
+        return surf
+
+    # 只映射需要的行，取出一块区域（大图按块流式加载用）
+    def region(self, path, rect):
+        entry = self.entry_path(path)
+        if not os.path.exists(entry):
+            self.load(path)
+        with open(entry, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            magic, width, height = self.header.unpack_from(data)
+            if magic != self.magic or len(data) != self.header.size + width * height * 4:
+                raise ValueError(entry)
+            start = self.header.size + rect.top * width * 4
+            with memoryview(data)[start:start + rect.height * width * 4] as rows:
+                band = pygame.image.frombuffer(rows, (width, rect.height), 'RGBA')
+                surf = band.subsurface((rect.left, 0, rect.width, rect.height)).convert_alpha()
+                del band
+        return surf
+
+    def store(self, entry, surf):
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            temp = entry + '.tmp'
+            with open(temp, 'wb') as file:
+                file.write(self.header.pack(self.magic, *surf.get_size()))
+                file.write(pygame.image.tobytes(surf, 'RGBA'))
+            os.replace(temp, entry)
+        except OSError:
+            pass  # 缓存只是加速，写不进去就算了
+
+
+# 读取 PNG 文件头里的宽高，不解码像素；其他格式才整张加载
+def image_size(path):
+    with open(path, 'rb') as file:
+        header = file.read(24)
+    if header[:8] == b'\x89PNG\r\n\x1a\n':
+        return struct.unpack('>II', header[16:24])
+    return pygame.image.load(path).get_size()
+
+
+def write_str(out, text):
+    data = text.encode('utf-8')
+    out += struct.pack('<H', len(data)) + data
+
+
+def read_str(data, offset):
+    length, = struct.unpack_from('<H', data, offset)
+    offset += 2
+    return data[offset:offset + length].decode('utf-8'), offset + length
+
+
+# 文件夹里的帧按数字顺序排（0, 1, 2, ..., 10），其他文件名按字母顺序排在后面
+def frame_order(name):
+    stem = name.split('.')[0]
+    return (0, int(stem), name) if stem.isdigit() else (1, 0, name)
+
+
+# 图集：若干张大图加子矩形索引，一张图集页只读一次文件，小图都是它的子表面----------
+ATLAS_MAGIC = b'KATL'
+ATLAS_VERSION = 1
+ATLAS_HEADER = struct.Struct('<4sH')  # 魔数、版本，后面是 zlib 压缩的索引
+ATLAS_ENTRY = struct.Struct('<QQB4H')  # 源文件修改时间、大小、页号、子矩形
+
+
+class TextureAtlas:
+    def __init__(self, pages, entries):
+        self.pages = pages  # 页图像路径
+        self.entries = entries  # 规范化路径 -> (页号, 子矩形)
+        self.folders = {}  # 规范化文件夹 -> 排好序的文件名
+        for key in entries:
+            folder, name = os.path.split(key)
+            self.folders.setdefault(folder, []).append(name)
+        for names in self.folders.values():
+            names.sort(key=frame_order)
+
+
+def atlas_index_path(directory=ATLAS_DIR):
+    return os.path.join(directory, 'index.bin')
+
+
+# 离线打包：按高度从大到小逐行（shelf）排进 page_size 见方的页，页高裁到实际用到的高度
+def pack_atlas(sources=ATLAS_SOURCES, directory=ATLAS_DIR, page_size=ATLAS_PAGE_SIZE):
+    images = []
+    for source in sources:
+        for root, _, files in walk(source):
+            for name in files:
+                if name.lower().endswith('.png'):
+                    path = os.path.join(root, name)
+                    images.append((path, pygame.image.load(path)))
+    images.sort(key=lambda item: (-item[1].get_height(), -item[1].get_width(), item[0]))
+
+    placements = []  # (路径, 图像, 页号, x, y)
+    page, x, y, shelf = 0, 0, 0, 0
+    heights = [0]
+    for path, surf in images:
+        width, height = surf.get_size()
+        if width > page_size or height > page_size:
+            raise ValueError(f'{path} does not fit in a {page_size} atlas page')
+        if x + width > page_size:
+            x, y, shelf = 0, y + shelf, 0
+        if y + height > page_size:
+            page, x, y, shelf = page + 1, 0, 0, 0
+            heights.append(0)
+        placements.append((path, surf, page, x, y))
+        x += width
+        shelf = max(shelf, height)
+        heights[page] = max(heights[page], y + height)
+
+    os.makedirs(directory, exist_ok=True)
+    pages = []
+    for index, height in enumerate(heights):
+        sheet = pygame.Surface((page_size, height), pygame.SRCALPHA)
+        for path, surf, page, x, y in placements:
+            if page == index:
+                sheet.blit(surf, (x, y))
+        name = f'page{index}.png'
+        pygame.image.save(sheet, os.path.join(directory, name))
+        pages.append(name)
+
+    out = bytearray(struct.pack('<H', len(pages)))
+    for name in pages:
+        write_str(out, name)
+    # 文件夹的修改时间：增删文件后图集也算过期
+    folders = sorted({os.path.dirname(path) for path, *_ in placements})
+    out += struct.pack('<H', len(folders))
+    for folder in folders:
+        write_str(out, os.path.relpath(folder, directory))
+        out += struct.pack('<Q', os.stat(folder).st_mtime_ns)
+    out += struct.pack('<H', len(placements))
+    for path, surf, page, x, y in placements:
+        stat = os.stat(path)
+        write_str(out, os.path.relpath(path, directory))
+        out += ATLAS_ENTRY.pack(stat.st_mtime_ns, stat.st_size, page, x, y, *surf.get_size())
+    with open(atlas_index_path(directory), 'wb') as file:
+        file.write(ATLAS_HEADER.pack(ATLAS_MAGIC, ATLAS_VERSION))
+        file.write(zlib.compress(bytes(out)))
+    return pages, len(placements)
+
+
+# 读取图集索引；没有图集、格式不对或任何源图改过都返回 None，退回逐个文件加载
+def load_atlas(directory=ATLAS_DIR):
+    try:
+        with open(atlas_index_path(directory), 'rb') as file:
+            magic, version = ATLAS_HEADER.unpack(file.read(ATLAS_HEADER.size))
+            if magic != ATLAS_MAGIC or version != ATLAS_VERSION:
+                return None
+            data = zlib.decompress(file.read())
+        count, = struct.unpack_from('<H', data)
+        offset = 2
+        pages = []
+        for _ in range(count):
+            name, offset = read_str(data, offset)
+            pages.append(os.path.join(directory, name))
+        count, = struct.unpack_from('<H', data, offset)
+        offset += 2
+        for _ in range(count):
+            name, offset = read_str(data, offset)
+            mtime, = struct.unpack_from('<Q', data, offset)
+            offset += 8
+            if os.stat(os.path.join(directory, name)).st_mtime_ns != mtime:
+                return None
+        count, = struct.unpack_from('<H', data, offset)
+        offset += 2
+        entries = {}
+        for _ in range(count):
+            name, offset = read_str(data, offset)
+            mtime, size, page, *rect = ATLAS_ENTRY.unpack_from(data, offset)
+            offset += ATLAS_ENTRY.size
+            path = os.path.join(directory, name)
+            stat = os.stat(path)
+            if (stat.st_mtime_ns, stat.st_size) != (mtime, size):
+                return None
+            entries[os.path.normpath(path)] = (page, pygame.Rect(rect))
+    except (OSError, ValueError, struct.error, zlib.error):
+        return None
+    return TextureAtlas(pages, entries)
+
+
+# 图像资源注册表：每张图只从磁盘解码、转换一次，之后全局共享同一个 Surface-----------
+class AssetRegistry:
+    def __init__(self, disk_cache=None, atlas=None):
+        self.disk_cache = disk_cache
+        self.atlas = atlas
+        self.pages = {}  # 图集页号 -> Surface
+        self.surfaces = {}  # 规范化路径 -> Surface
+        self.folders = {}  # 规范化路径 -> [Surface] / {名字: Surface}
+        self.hits = 0
+        self.misses = 0
+        self.reads = 0  # 实际读取的图像文件数
+
+    def image(self, path):
+        key = os.path.normpath(path)
+        surf = self.surfaces.get(key)
+        if surf is None:
+            self.misses += 1
+            if self.atlas and key in self.atlas.entries:
+                page, rect = self.atlas.entries[key]
+                surf = self.page(page).subsurface(rect)
+            else:
+                surf = self.load(path)
+            self.surfaces[key] = surf
+        else:
+            self.hits += 1
+        return surf
+
+    def page(self, index):
+        if index not in self.pages:
+            self.pages[index] = self.load(self.atlas.pages[index])
+        return self.pages[index]
+
+    # 直接加载不进注册表，用于只用一次的大图（如地面）
+    def load(self, path):
+        self.reads += 1
+        if self.disk_cache:
+            return self.disk_cache.load(path)
+        return pygame.image.load(path).convert_alpha()  # convert_alpha支持透明度处理
+
+    def folder(self, path):
+        key = ('list', os.path.normpath(path))
+        if key in self.folders:
+            self.hits += len(self.folders[key])
+        else:
+            self.folders[key] = [self.image(path + '/' + image) for image in self.folder_files(path)]
+        return self.folders[key]
+
+    def folder_dict(self, path):
+        key = ('dict', os.path.normpath(path))
+        if key in self.folders:
+            self.hits += len(self.folders[key])
+        else:
+            self.folders[key] = {image.split('.')[0]: self.image(path + '/' + image)
+                                 for image in self.folder_files(path)}
+        return self.folders[key]
+
+    def folder_files(self, path):
+        if self.atlas:
+            names = self.atlas.folders.get(os.path.normpath(path))
+            if names:
+                return names
+        files = []
+        for _, __, img_files in walk(path):
+            files.extend(img_files)
+        return sorted(files, key=frame_order)
+
+    # 已缓存图像占用的像素内存（字节），图集里的小图只算它所在的页
+    def memory(self):
+        roots = [surf for surf in self.surfaces.values() if surf.get_parent() is None]
+        return sum(surf.get_pitch() * surf.get_height() for surf in roots + list(self.pages.values()))
+
+    def stats(self):
+        stats = {'hits': self.hits, 'misses': self.misses, 'reads': self.reads,
+                 'surfaces': len(self.surfaces), 'bytes': self.memory()}
+        if self.disk_cache:
+            stats.update(disk_hits=self.disk_cache.hits, disk_misses=self.disk_cache.misses)
+        return stats
+
+
+assets = AssetRegistry(SurfaceDiskCache(SURFACE_CACHE_DIR) if USE_SURFACE_CACHE else None,
+                       load_atlas() if USE_ATLAS else None)
+
+
 # 从文件夹读出图像，存入二维列表（字典）-------------------------------------------------------
-# 导入文件夹，返回文件夹下的文件图像列表
+# 导入文件夹，返回文件夹下的文件图像列表（共享缓存，不要修改返回的列表）
 def import_folder(path):
-    surface_list = []
-    for _, __, img_files in walk(path):
-        for image in img_files:
-            full_path = path + '/' + image
-            image_surf = pygame.image.load(full_path).convert_alpha()  # convert_alpha支持透明度处理
-            surface_list.append(image_surf)
-    return surface_list
+    return assets.folder(path)
 
 
 # 导入文件夹，返回文件夹下的文件图像字典（文件夹名：文件图像）
 def import_folder_dict(path):
-    surface_dict = {}
-    for _, __, img_files in walk(path):
-        for image in img_files:
-            full_path = path + '/' + image
-            image_surf = pygame.image.load(full_path).convert_alpha()
-            surface_dict[image.split('.')[0]] = image_surf
-    return surface_dict
+    return assets.folder_dict(path)
+
+
+# 地图加载：map.tmx 只解析一次，所有地方共享；有预编译的二进制地图时直接读它---------
+# 二进制地图由 tools.py compile-map 生成，记录了 tmx 和 tsx 的修改时间与大小，
+# 任何一个对不上就认为过期，退回解析 tmx
+class CompiledObject:
+    def __init__(self, name, x, y, width, height, image):
+        self.name = name
+        self.x = x
+        self.y = y
+        self.width = width
+        self.height = height
+        self.image = image
+
+
+class CompiledTileLayer:
+    def __init__(self, name, width, data, images):
+        self.name = name
+        self.width = width
+        self.data = data  # 按行展开的 gid 数组
+        self.images = images
+
+    def tiles(self):
+        for index, gid in enumerate(self.data):
+            if gid:
+                yield index % self.width, index // self.width, self.images[gid]
+
+
+class CompiledMap:
+    def __init__(self, width, height, layers):
+        self.width = width
+        self.height = height
+        self.layers = layers  # 图层名 -> CompiledTileLayer / [CompiledObject]
+
+    def get_layer_by_name(self, name):
+        return self.layers[name]
+
+
+MAP_MAGIC = b'KMAP'
+MAP_VERSION = 1
+MAP_HEADER = struct.Struct('<4sHHHHH')  # 魔数、版本、宽、高、瓦片宽、瓦片高
+
+
+def compiled_map_path(path):
+    return os.path.splitext(path)[0] + '.bin'
+
+
+# 地图依赖的文件：tmx 本身和它引用的 tsx
+def map_dependencies(path):
+    folder = os.path.dirname(path)
+    tilesets = ElementTree.parse(path).getroot().findall('tileset')
+    return [path] + [os.path.join(folder, tileset.get('source')) for tileset in tilesets if tileset.get('source')]
+
+
+# 离线编译：用一个只记录来源的图像加载器解析 tmx，把图层、对象和每个 gid 的图像来源写成二进制
+def compile_map(path=MAP_PATH):
+    def record_loader(filename, colorkey, **kwargs):
+        return lambda rect=None, flags=None: (filename, rect, flags)
+
+    tmx = TiledMap(path, image_loader=record_loader)
+    if len(tmx.images) > 0xFFFF:
+        raise ValueError('too many tile gids for the compiled map format')
+    folder = os.path.dirname(path)
+    out = bytearray()
+    dependencies = map_dependencies(path)
+    out += struct.pack('<H', len(dependencies))
+    for dependency in dependencies:
+        stat = os.stat(dependency)
+        write_str(out, os.path.relpath(dependency, folder))
+        out += struct.pack('<QQ', stat.st_mtime_ns, stat.st_size)
+    # gid -> 图像来源（相对地图目录的文件、子矩形、翻转标记）
+    out += struct.pack('<I', len(tmx.images))
+    for image in tmx.images:
+        if image is None:
+            out += b'\0'
+            continue
+        filename, rect, flags = image
+        flag_bits = (flags.flipped_horizontally | flags.flipped_vertically << 1 |
+                     flags.flipped_diagonally << 2) if flags else 0
+        out += struct.pack('<BB', 2 if rect else 1, flag_bits)
+        write_str(out, os.path.relpath(filename, folder))
+        if rect:
+            out += struct.pack('<4H', *rect)
+    out += struct.pack('<H', len(tmx.layers))
+    for layer in tmx.layers:
+        if isinstance(layer, TiledTileLayer):
+            out += b'\0'
+            write_str(out, layer.name)
+            out += array('H', (gid for row in layer.data for gid in row)).tobytes()
+        elif isinstance(layer, TiledObjectGroup):
+            out += b'\1'
+            write_str(out, layer.name)
+            out += struct.pack('<I', len(layer))
+            for obj in layer:
+                write_str(out, obj.name or '')
+                out += struct.pack('<4dH', obj.x, obj.y, obj.width, obj.height, obj.gid)
+    with open(compiled_map_path(path), 'wb') as file:
+        file.write(MAP_HEADER.pack(MAP_MAGIC, MAP_VERSION, tmx.width, tmx.height, tmx.tilewidth, tmx.tileheight))
+        file.write(zlib.compress(bytes(out)))
+
+
+# 读取二进制地图，过期或格式不对时返回 None
+def read_compiled_map(path, source):
+    with open(path, 'rb') as file:
+        magic, version, width, height, _, __ = MAP_HEADER.unpack(file.read(MAP_HEADER.size))
+        if magic != MAP_MAGIC or version != MAP_VERSION:
+            return None
+        data = zlib.decompress(file.read())
+    folder = os.path.dirname(source)
+    count, = struct.unpack_from('<H', data)
+    offset = 2
+    for _ in range(count):
+        name, offset = read_str(data, offset)
+        mtime, size = struct.unpack_from('<QQ', data, offset)
+        offset += 16
+        try:
+            stat = os.stat(os.path.join(folder, name))
+        except OSError:
+            return None
+        if (stat.st_mtime_ns, stat.st_size) != (mtime, size):
+            return None
+
+    count, = struct.unpack_from('<I', data, offset)
+    offset += 4
+    images = []
+    for _ in range(count):
+        kind = data[offset]
+        offset += 1
+        if kind == 0:
+            images.append(None)
+            continue
+        flag_bits = data[offset]
+        name, offset = read_str(data, offset + 1)
+        image = assets.image(os.path.join(folder, name))
+        if kind == 2:
+            image = image.subsurface(struct.unpack_from('<4H', data, offset))
+            offset += 8
+        if flag_bits:
+            image = handle_transformation(image, TileFlags(bool(flag_bits & 1), bool(flag_bits & 2),
+                                                           bool(flag_bits & 4)))
+        images.append(image)
+
+    count, = struct.unpack_from('<H', data, offset)
+    offset += 2
+    layers = {}
+    for _ in range(count):
+        kind = data[offset]
+        name, offset = read_str(data, offset + 1)
+        if kind == 0:
+            gids = array('H')
+            gids.frombytes(data[offset:offset + width * height * 2])
+            offset += width * height * 2
+            layers[name] = CompiledTileLayer(name, width, gids, images)
+        else:
+            objects = []
+            total, = struct.unpack_from('<I', data, offset)
+            offset += 4
+            for _ in range(total):
+                obj_name, offset = read_str(data, offset)
+                x, y, w, h, gid = struct.unpack_from('<4dH', data, offset)
+                offset += 34
+                objects.append(CompiledObject(obj_name or None, x, y, w, h, images[gid] if gid else None))
+            layers[name] = objects
+    return CompiledMap(width, height, layers)
+
+
+@functools.lru_cache(maxsize=None)
+def load_map(path=MAP_PATH):
+    compiled = compiled_map_path(path)
+    if os.path.exists(compiled):
+        try:
+            tmx_data = read_compiled_map(compiled, path)
+        except (OSError, ValueError, struct.error, zlib.error):
+            tmx_data = None
+        if tmx_data:
+            return tmx_data
+    return load_pygame(path)
+
+
+# 文字渲染缓存：字体按（路径，字号）只加载一次，渲染结果按 LRU 缓存------------------
+class TextCache:
+    def __init__(self, max_size=TEXT_CACHE_SIZE):
+        self.fonts = {}  # (路径, 字号) -> Font
+        self.surfaces = OrderedDict()  # (路径, 字号, 文字, 颜色, 抗锯齿) -> Surface
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+
+    def font(self, size, path=FONT_PATH):
+        key = (path, size)
+        if key not in self.fonts:
+            self.fonts[key] = pygame.font.Font(path, size)
+        return self.fonts[key]
+
+    def render(self, text, color, size, antialias=True, path=FONT_PATH):
+        key = (path, size, text, color, antialias)
+        surf = self.surfaces.get(key)
+        if surf is not None:
+            self.hits += 1
+            self.surfaces.move_to_end(key)
+            return surf
+        self.misses += 1
+        surf = self.font(size, path).render(text, antialias, color)
+        self.surfaces[key] = surf
+        if len(self.surfaces) > self.max_size:
+            self.surfaces.popitem(last=False)
+        return surf
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self.surfaces),
+                'fonts': len(self.fonts), 'hit_rate': self.hits / total if total else 0.0}
+
+
+text_cache = TextCache()
+
+
+# 帧性能分析：记录每帧各阶段耗时、精灵数和绘制次数，可显示 HUD、导出 trace/csv------------
+# 关闭时 section() 直接返回一个空的上下文，begin_frame/end_frame 立即返回
+class ProfileSection:
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+        self.start = 0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        self.profiler.record(self.name, self.start, time.perf_counter() - self.start)
+
+
+class FrameProfiler:
+    def __init__(self, history=PROFILER_HISTORY):
+        self.enabled = False
+        self.hud_visible = False
+        self.frames = deque(maxlen=history)  # 每帧 {'start', 'duration', 'phases', 'events', 'sprites', 'blits'}
+        self.current = None
+        self.sections = {}
+        self.null_section = nullcontext()
+        self.origin = time.perf_counter()
+        # HUD 文字每隔一段时间才重新渲染
+        self.hud_surfs = []
+        self.hud_time = 0
+
+    def toggle_hud(self):
+        self.hud_visible = not self.hud_visible
+        self.enabled = self.hud_visible
+
+    def section(self, name):
+        if not self.enabled:
+            return self.null_section
+        if name not in self.sections:
+            self.sections[name] = ProfileSection(self, name)
+        return self.sections[name]
+
+    def record(self, name, start, duration):
+        if self.current is None:
+            return
+        phases = self.current['phases']
+        phases[name] = phases.get(name, 0) + duration
+        self.current['events'].append((name, start, duration))
+
+    def begin_frame(self):
+        if not self.enabled:
+            return
+        self.current = {'start': time.perf_counter(), 'phases': {}, 'events': []}
+
+    def end_frame(self, sprites=0, blits=0):
+        if not self.enabled or self.current is None:
+            return
+        frame = self.current
+        frame['duration'] = time.perf_counter() - frame['start']
+        frame['sprites'] = sprites
+        frame['blits'] = blits
+        self.frames.append(frame)
+        self.current = None
+
+    def percentiles(self, *quantiles):
+        durations = sorted(frame['duration'] for frame in self.frames)
+        if not durations:
+            return [0.0 for _ in quantiles]
+        return [durations[int(q * (len(durations) - 1))] * 1000 for q in quantiles]
+
+    def display(self, surface):
+        if not self.hud_visible or not self.frames:
+            return
+        now = pygame.time.get_ticks()  # HUD 按真实时间刷新
+        if now - self.hud_time >= PROFILER_HUD_INTERVAL:
+            self.hud_time = now
+            self.hud_surfs = [text_cache.font(16).render(line, True, 'white') for line in self.hud_lines()]
+        top = 70
+        width = max(surf.get_width() for surf in self.hud_surfs) + 16
+        panel = pygame.Rect(10, top, width, len(self.hud_surfs) * 20 + 12)
+        pygame.draw.rect(surface, (0, 0, 0), panel)
+        for index, surf in enumerate(self.hud_surfs):
+            surface.blit(surf, (18, top + 6 + index * 20))
+
+    def hud_lines(self):
+        frames = list(self.frames)[-60:]
+        average = sum(frame['duration'] for frame in frames) / len(frames)
+        p50, p95, p99 = self.percentiles(0.5, 0.95, 0.99)
+        lines = [f'FPS {1 / average if average else 0:.0f}   p50 {p50:.1f}  p95 {p95:.1f}  p99 {p99:.1f} ms',
+                 f'sprites {frames[-1]["sprites"]}   blits {frames[-1]["blits"]}']
+        totals = {}
+        for frame in frames:
+            for name, duration in frame['phases'].items():
+                totals[name] = totals.get(name, 0) + duration
+        for name, duration in sorted(totals.items(), key=lambda item: -item[1]):
+            lines.append(f'{name:<28}{duration / len(frames) * 1000:6.2f} ms')
+        return lines
+
+    # Chrome 的 about:tracing / Perfetto 可以直接打开
+    def export_trace(self, path):
+        events = []
+        for index, frame in enumerate(self.frames):
+            events.append({'name': f'frame {index}', 'ph': 'X', 'pid': 0, 'tid': 0,
+                           'ts': (frame['start'] - self.origin) * 1e6, 'dur': frame['duration'] * 1e6,
+                           'args': {'sprites': frame['sprites'], 'blits': frame['blits']}})
+            for name, start, duration in frame['events']:
+                events.append({'name': name, 'ph': 'X', 'pid': 0, 'tid': 0,
+                               'ts': (start - self.origin) * 1e6, 'dur': duration * 1e6})
+        with open(path, 'w', encoding='utf-8') as file:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, file)
+
+    def export_csv(self, path):
+        names = sorted({name for frame in self.frames for name in frame['phases']})
+        with open(path, 'w', newline='', encoding='utf-8') as file:
+            writer = csv.writer(file)
+            writer.writerow(['frame', 'frame_ms', 'sprites', 'blits'] + [f'{name}_ms' for name in names])
+            for index, frame in enumerate(self.frames):
+                writer.writerow([index, round(frame['duration'] * 1000, 3), frame['sprites'], frame['blits']] +
+                                [round(frame['phases'].get(name, 0) * 1000, 3) for name in names])
+
+    # 导出到 PROFILE_DIR，文件名带时间戳
+    def export(self):
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        stamp = time.strftime('%Y%m%d-%H%M%S')
+        self.export_trace(os.path.join(PROFILE_DIR, f'trace-{stamp}.json'))
+        self.export_csv(os.path.join(PROFILE_DIR, f'frames-{stamp}.csv'))
+
+
+profiler = FrameProfiler()
+
+
+# 输入与游戏时钟：逻辑只从 controls 读按键、从 game_clock 读时间，--------------
+# 这样每帧的输入可以录下来，回放时原样喂回去
+GAME_KEYS = (pygame.K_UP, pygame.K_DOWN, pygame.K_LEFT, pygame.K_RIGHT, pygame.K_SPACE,
+             pygame.K_q, pygame.K_e, pygame.K_LCTRL, pygame.K_RETURN, pygame.K_ESCAPE)
+
+RECORD_MAGIC = b'KREC'
+RECORD_VERSION = 1
+RECORD_HEADER = struct.Struct('<4sHQ')  # 魔数、版本、随机种子
+RECORD_FRAME = struct.Struct('<dHB')  # dt、按键位图、鼠标点击次数
+RECORD_CLICK = struct.Struct('<hh')
+
+
+class InputState:
+    def __init__(self):
+        self.keys = dict.fromkeys(GAME_KEYS, False)
+        self.clicks = []  # 本帧左键点击的位置
+
+    # 实时读取键盘
+    def poll(self, clicks):
+        pressed = pygame.key.get_pressed()
+        self.keys = {key: bool(pressed[key]) for key in GAME_KEYS}
+        self.clicks = clicks
+
+    def mask(self):
+        return sum(1 << bit for bit, key in enumerate(GAME_KEYS) if self.keys[key])
+
+    def set_mask(self, mask, clicks):
+        self.keys = {key: bool(mask >> bit & 1) for bit, key in enumerate(GAME_KEYS)}
+        self.clicks = clicks
+
+
+class GameClock:
+    def __init__(self):
+        self.time = 0.0
+
+    def advance(self, dt):
+        self.time += dt
+
+    def ticks(self):
+        return int(self.time * 1000)
+
+
+controls = InputState()
+game_clock = GameClock()
+
+
+class InputRecorder:
+    def __init__(self, path, seed):
+        self.file = open(path, 'wb')
+        self.file.write(RECORD_HEADER.pack(RECORD_MAGIC, RECORD_VERSION, seed))
+
+    def write(self, dt, state):
+        self.file.write(RECORD_FRAME.pack(dt, state.mask(), len(state.clicks)))
+        for pos in state.clicks:
+            self.file.write(RECORD_CLICK.pack(*pos))
+
+    def close(self):
+        self.file.close()
+
+
+class InputReplay:
+    def __init__(self, path):
+        with open(path, 'rb') as file:
+            self.data = file.read()
+        magic, version, self.seed = RECORD_HEADER.unpack_from(self.data)
+        if magic != RECORD_MAGIC:
+            raise ValueError('not an input recording')
+        if version != RECORD_VERSION:
+            raise ValueError(f'unsupported recording version {version}')
+        self.offset = RECORD_HEADER.size
+        self.frame = 0
+
+    # 把下一帧的输入写进 state，返回这一帧的 dt；录像放完返回 None
+    def read(self, state):
+        if self.offset >= len(self.data):
+            return None
+        dt, mask, count = RECORD_FRAME.unpack_from(self.data, self.offset)
+        self.offset += RECORD_FRAME.size
+        clicks = [RECORD_CLICK.unpack_from(self.data, self.offset + index * RECORD_CLICK.size) for index in range(count)]
+        self.offset += count * RECORD_CLICK.size
+        state.set_mask(mask, clicks)
+        self.frame += 1
+        return dt
+
+
+# 声音：音效第一次播放时才解码并缓存，通过固定的通道池播放；背景音乐流式播放------------
+class SoundBank:
+    def __init__(self, sounds=SOUNDS, channels=SOUND_CHANNELS):
+        self.table = sounds
+        self.size = channels
+        self.enabled = True  # 无窗口模拟时关掉，什么都不加载
+        self.sounds = {}  # 名字 -> 解码好的 Sound
+        self.channels = []
+        self.voices = []  # 每个通道正在放的 (名字, 优先级, 序号)
+        self.counter = 0
+        self.stolen = 0
+        self.dropped = 0
+
+    def sound(self, name):
+        sound = self.sounds.get(name)
+        if sound is None:
+            path, volume, _, __ = self.table[name]
+            sound = pygame.mixer.Sound(path)
+            sound.set_volume(volume)
+            self.sounds[name] = sound
+        return sound
+
+    # 选一个通道：先找空闲的；同一音效已满时换掉它最早的一个；否则抢优先级不高于自己的最早的一个
+    def pick_channel(self, name, priority, limit):
+        playing = [index for index, channel in enumerate(self.channels) if channel.get_busy()]
+        same = [index for index in playing if self.voices[index][0] == name]
+        if len(same) >= limit:
+            return min(same, key=lambda index: self.voices[index][2])
+        for index, channel in enumerate(self.channels):
+            if index not in playing:
+                return index
+        candidates = [index for index in playing if self.voices[index][1] <= priority]
+        if not candidates:
+            return None
+        return min(candidates, key=lambda index: self.voices[index][1:])
+
+    def play(self, name):
+        if not self.enabled or not pygame.mixer.get_init():
+            return None
+        if not self.channels:
+            pygame.mixer.set_num_channels(self.size)
+            self.channels = [pygame.mixer.Channel(index) for index in range(self.size)]
+            self.voices = [(None, 0, 0)] * self.size
+        _, __, priority, limit = self.table[name]
+        index = self.pick_channel(name, priority, limit)
+        if index is None:
+            self.dropped += 1
+            return None
+        if self.channels[index].get_busy():
+            self.stolen += 1
+        self.counter += 1
+        self.voices[index] = (name, priority, self.counter)
+        self.channels[index].play(self.sound(name))
+        return self.channels[index]
+
+
+class MusicStream:
+    def __init__(self, path=MUSIC_PATH):
+        self.path = path
+        self.loaded = False
+
+    def play(self):
+        if not self.loaded:
+            try:
+                pygame.mixer.music.load(self.path)
+            except (pygame.error, OSError):
+                return  # 没有音乐文件就不放
+            self.loaded = True
+        pygame.mixer.music.play(loops=-1)
+
+    def stop(self):
+        if self.loaded:
+            pygame.mixer.music.stop()
+
+
+sounds = SoundBank()
 
 
 # 计时器（动作激活时间长短）-----------------------------------------------------------
@@ -112,14 +979,14 @@ class Timer:
 
     def activate(self):
         self.active = True
-        self.start_time = pygame.time.get_ticks()
+        self.start_time = game_clock.ticks()
 
     def deactivate(self):
         self.active = False
         self.start_time = 0
 
     def update(self):
-        current_time = pygame.time.get_ticks()
+        current_time = game_clock.ticks()
         if current_time - self.start_time >= self.duration:
             if self.func and self.start_time != 0:
                 self.func()
@@ -133,13 +1000,11 @@ class Transition:
         self.display_surface = pygame.display.get_surface()
         self.reset = reset
         self.player = player
-        # 屏幕、颜色、速度初始化
-        self.image = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT))
+        # 颜色、速度初始化（画面由 TintPass 和天色一起调暗）
         self.color = 255
         self.speed = -2
 
-    # 播放
-    def play(self):
+    def update(self):
         self.color += self.speed
         if self.color <= 0:
             self.speed *= -1
@@ -149,8 +1014,9 @@ class Transition:
             self.color = 255
             self.player.sleep = False
             self.speed = -2
-        self.image.fill((self.color, self.color, self.color))
-        self.display_surface.blit(self.image, (0, 0), special_flags=pygame.BLEND_RGBA_MULT)
+
+    def tint(self):
+        return self.color, self.color, self.color
 
 
 # 精灵类--------------------------------------------------------------
@@ -177,25 +1043,169 @@ class WildFlower(Generic):
 
 
 class Particle(Generic):
-    def __init__(self, pos, surf, groups, z, duration=200):
+    def __init__(self, pos, surf, groups, z, duration=200, pool=None):
         super().__init__(pos, surf, groups, z)
-        self.start_time = pygame.time.get_ticks()
+        self.pool = pool  # 到期后还给对象池，没有池就直接销毁
+        self.start(duration)
+
+    def start(self, duration):
+        self.start_time = game_clock.ticks()
         self.duration = duration
-        # white surface
-        mask_surf = pygame.mask.from_surface(self.image)
-        new_surf = mask_surf.to_surface()
-        new_surf.set_colorkey((0, 0, 0))
-        self.image = new_surf
 
     def update(self, dt):
-        current_time = pygame.time.get_ticks()
+        current_time = game_clock.ticks()
         if current_time - self.start_time > self.duration:
-            self.kill()
+            if self.pool:
+                self.pool.release(self)
+            else:
+                self.kill()
+
+
+# 粒子对象池：白色剪影按源图像缓存一次，到期的粒子回收后重复使用
+class ParticlePool:
+    def __init__(self, groups):
+        self.groups = groups
+        self.free = []
+        self.silhouettes = weakref.WeakKeyDictionary()  # 源图像 -> 白色剪影，源图像释放后自动清掉
+
+    def silhouette(self, surf):
+        image = self.silhouettes.get(surf)
+        if image is None:
+            image = pygame.mask.from_surface(surf).to_surface()
+            image.set_colorkey((0, 0, 0))
+            self.silhouettes[surf] = image
+        return image
+
+    def emit(self, pos, surf, z, duration=200):
+        image = self.silhouette(surf)
+        if not self.free:
+            return Particle(pos, image, self.groups, z, duration, self)
+        particle = self.free.pop()
+        particle.image = image
+        particle.rect.size = image.get_size()
+        particle.rect.topleft = pos
+        particle.z = z
+        particle.start(duration)
+        particle.add(self.groups)
+        return particle
+
+    def release(self, particle):
+        particle.kill()
+        self.free.append(particle)
+
+
+# 空间哈希：按瓦片网格索引精灵的碰撞盒，只查询与目标矩形重叠的单元-----------
+class SpatialGroup(pygame.sprite.Group):
+    def __init__(self, attr='hitbox', cell_size=TILE_SIZE):
+        super().__init__()
+        self.attr = attr  # 用来建索引的矩形属性名（hitbox 或 rect）
+        self.cell_size = cell_size
+        self.cells = {}  # 单元坐标 -> {精灵: None}
+        self.placement = {}  # 精灵 -> (矩形副本, 单元坐标列表)
+        self.sequence = {}  # 精灵 -> 加入顺序，查询结果按原来的遍历顺序返回
+        self.counter = 0
+        # 精灵加入组时往往还没有碰撞盒，先挂起，查询前再建索引
+        self.pending = {}
+
+    def add_internal(self, sprite, layer=None):
+        super().add_internal(sprite, layer)
+        self.sequence[sprite] = self.counter
+        self.counter += 1
+        self.pending[sprite] = None
+
+    def remove_internal(self, sprite):
+        super().remove_internal(sprite)
+        self.pending.pop(sprite, None)
+        self.unindex(sprite)
+        del self.sequence[sprite]
+
+    def cell_keys(self, rect):
+        cs = self.cell_size
+        return [(col, row)
+                for row in range(rect.top // cs, (rect.bottom - 1) // cs + 1)
+                for col in range(rect.left // cs, (rect.right - 1) // cs + 1)]
+
+    def index(self, sprite):
+        rect = getattr(sprite, self.attr, None)
+        if rect is None:
+            return
+        keys = self.cell_keys(rect)
+        for key in keys:
+            self.cells.setdefault(key, {})[sprite] = None
+        self.placement[sprite] = (rect.copy(), keys)
+
+    def unindex(self, sprite):
+        placed = self.placement.pop(sprite, None)
+        if placed is None:
+            return
+        for key in placed[1]:
+            cell = self.cells[key]
+            del cell[sprite]
+            if not cell:
+                del self.cells[key]
+
+    # 碰撞盒被替换或移动后调用（例如 Plant.grow）
+    def refresh(self, sprite):
+        if sprite in self.pending:
+            return
+        placed = self.placement.get(sprite)
+        if placed is not None and placed[0] == getattr(sprite, self.attr, None):
+            return
+        self.unindex(sprite)
+        self.index(sprite)
+
+    def query(self, rect):
+        for sprite in tuple(self.pending):
+            del self.pending[sprite]
+            self.index(sprite)
+        found = {}
+        for key in self.cell_keys(rect):
+            cell = self.cells.get(key)
+            if cell:
+                found.update(cell)
+        return sorted(found, key=self.sequence.__getitem__)
+
+
+# 静态碰撞位图：不绘制的碰撞瓦片每格只占一位，碰撞盒形状和 Generic 相同------------
+class CollisionMap:
+    def __init__(self, width, height, order=0, tile_size=TILE_SIZE):
+        self.width = width
+        self.height = height
+        self.tile_size = tile_size
+        self.row_bytes = (width + 7) // 8
+        self.bits = bytearray(self.row_bytes * height)
+        # 原来这些瓦片在碰撞组里的加入位置，和组里的精灵合并时保持原来的先后
+        self.order = order
+        self.count = 0
+
+    def set(self, x, y):
+        if not self.get(x, y):
+            self.bits[y * self.row_bytes + (x >> 3)] |= 1 << (x & 7)
+            self.count += 1
+
+    def get(self, x, y):
+        return (0 <= x < self.width and 0 <= y < self.height and
+                bool(self.bits[y * self.row_bytes + (x >> 3)] >> (x & 7) & 1))
+
+    def hitbox(self, x, y):
+        rect = pygame.Rect(x * self.tile_size, y * self.tile_size, self.tile_size, self.tile_size)
+        return rect.inflate(-rect.width * 0.2, -rect.height * 0.75)
+
+    # 与 rect 所在格子重叠的碰撞瓦片，逐行返回它们的碰撞盒
+    def query(self, rect):
+        ts = self.tile_size
+        return [self.hitbox(x, y)
+                for y in range(max(rect.top // ts, 0), min((rect.bottom - 1) // ts + 1, self.height))
+                for x in range(max(rect.left // ts, 0), min((rect.right - 1) // ts + 1, self.width))
+                if self.bits[y * self.row_bytes + (x >> 3)] >> (x & 7) & 1]
+
+    def memory(self):
+        return len(self.bits)
 
 
 # 玩家设置-------------------------------------------------------------
 class Player(pygame.sprite.Sprite):
-    def __init__(self, pos, group, collision_sprites, interaction, soil_layer, toggle_shop):
+    def __init__(self, pos, group, collision_sprites, interaction, soil_layer, toggle_shop, collision_map=None):
         super().__init__(group)
 
         self.import_assets()
@@ -215,6 +1225,7 @@ class Player(pygame.sprite.Sprite):
         # 交互
         self.hitbox = self.rect.copy().inflate((-126, -70))
         self.collision_sprites = collision_sprites
+        self.collision_map = collision_map
 
         # 时间间隔
         self.timers = {
@@ -252,17 +1263,13 @@ class Player(pygame.sprite.Sprite):
         self.soil_layer = soil_layer
         self.toggle_shop = toggle_shop
 
-        # 音频导入
-        self.watering = pygame.mixer.Sound('../audio/water.mp3')
-        self.watering.set_volume(0.2)
-
     def use_tool(self):
         if self.selected_tool == 'hoe':
             self.soil_layer.get_hit(self.target_pos)
 
         if self.selected_tool == 'water':
             self.soil_layer.water(self.target_pos)
-            self.watering.play()
+            sounds.play('water')
 
     # 获取工具使用目标位置
     def get_target_pos(self):
@@ -274,6 +1281,21 @@ class Player(pygame.sprite.Sprite):
             self.soil_layer.plant_seed(self.target_pos, self.selected_seed)
             self.seed_inventory[self.selected_seed] -= 1
 
+    # 买卖（商店和无窗口模拟共用）
+    def sell(self, item):
+        if self.item_inventory.get(item, 0) > 0:
+            self.item_inventory[item] -= 1
+            self.money += SALE_PRICES[item]
+            return True
+        return False
+
+    def buy(self, seed):
+        if self.money >= PURCHASE_PRICES[seed]:
+            self.seed_inventory[seed] = self.seed_inventory.get(seed, 0) + 1
+            self.money -= PURCHASE_PRICES[seed]
+            return True
+        return False
+
     def import_assets(self):
         self.animations = {'up': [], 'down': [], 'left': [], 'right': [],
                            'right_idle': [], 'left_idle': [], 'up_idle': [], 'down_idle': [],
@@ -293,7 +1315,7 @@ class Player(pygame.sprite.Sprite):
 
     # 键盘输入
     def input(self):
-        keys = pygame.key.get_pressed()
+        keys = controls.keys
         if not self.timers['tool use'].active and not self.sleep:
             # 移动 获得方向向量（y分量）
             if keys[pygame.K_UP]:
@@ -361,25 +1383,34 @@ class Player(pygame.sprite.Sprite):
             timer.update()
 
     # 碰撞盒检测
+    # 附近的碰撞盒：碰撞组里的精灵和静态碰撞位图，按原来加入碰撞组的先后合并
+    def colliders(self):
+        sprites = self.collision_sprites.query(self.hitbox)
+        static = self.collision_map.query(self.hitbox) if self.collision_map else []
+        if not static:
+            return [sprite.hitbox for sprite in sprites]
+        order = self.collision_sprites.sequence
+        cut = sum(1 for sprite in sprites if order[sprite] < self.collision_map.order)
+        return [sprite.hitbox for sprite in sprites[:cut]] + static + [sprite.hitbox for sprite in sprites[cut:]]
+
     def collision(self, direction):
-        for sprite in self.collision_sprites.sprites():
-            if hasattr(sprite, 'hitbox'):
-                if sprite.hitbox.colliderect(self.hitbox):
-                    if direction == 'horizontal':
-                        if self.direction.x > 0:  # moving right
-                            self.hitbox.right = sprite.hitbox.left
-                        if self.direction.x < 0:  # moving left
-                            self.hitbox.left = sprite.hitbox.right
-                        self.rect.centerx = self.hitbox.centerx
-                        self.pos.x = self.hitbox.centerx
-
-                    if direction == 'vertical':
-                        if self.direction.y > 0:  # moving down
-                            self.hitbox.bottom = sprite.hitbox.top
-                        if self.direction.y < 0:  # moving up
-                            self.hitbox.top = sprite.hitbox.bottom
-                        self.rect.centery = self.hitbox.centery
-                        self.pos.y = self.hitbox.centery
+        for hitbox in self.colliders():
+            if hitbox.colliderect(self.hitbox):
+                if direction == 'horizontal':
+                    if self.direction.x > 0:  # moving right
+                        self.hitbox.right = hitbox.left
+                    if self.direction.x < 0:  # moving left
+                        self.hitbox.left = hitbox.right
+                    self.rect.centerx = self.hitbox.centerx
+                    self.pos.x = self.hitbox.centerx
+
+                if direction == 'vertical':
+                    if self.direction.y > 0:  # moving down
+                        self.hitbox.bottom = hitbox.top
+                    if self.direction.y < 0:  # moving up
+                        self.hitbox.top = hitbox.bottom
+                    self.rect.centery = self.hitbox.centery
+                    self.pos.y = self.hitbox.centery
 
     def move(self, dt):
         # 向量归一化
@@ -422,43 +1453,163 @@ class WaterTile(pygame.sprite.Sprite):
         self.z = LAYERS['soil water']
 
 
+# 瓦片对象池：停用的瓦片离开所有组留在池里，再次使用时只换图和位置
+class TilePool:
+    def __init__(self, tile_class, groups):
+        self.tile_class = tile_class
+        self.groups = groups
+        self.free = []
+
+    def acquire(self, pos, surf):
+        if not self.free:
+            return self.tile_class(pos, surf, self.groups)
+        tile = self.free.pop()
+        tile.image = surf
+        tile.rect.size = surf.get_size()
+        tile.rect.topleft = pos
+        tile.add(self.groups)
+        return tile
+
+    def release(self, tile):
+        tile.kill()
+        self.free.append(tile)
+
+
 class Plant(pygame.sprite.Sprite):
-    def __init__(self, plant_type, groups, soil, check_watered):
+    def __init__(self, plant_type, groups, soil):
         super().__init__(groups)
 
         # setup
         self.plant_type = plant_type
-        self.frames = import_folder(f'../graphics/fruit/{plant_type}')
+        self.frames = import_folder(CROPS[plant_type]['frames'])
         self.soil = soil
-        self.check_watered = check_watered
         self.alive = True
+        self.slot = None  # 在 CropField 里的下标
 
-        # plant growing
+        # plant growing（生长状态由 CropField 统一推进，这里只保存同步过来的结果）
         self.age = 0
         self.max_age = len(self.frames) - 1
-        self.grow_speed = GROW_SPEED[plant_type]
         self.harvestable = False
 
         # sprite setup
         self.image = self.frames[self.age]
-        self.y_offset = -16 if plant_type == 'corn' else -8
+        self.y_offset = CROPS[plant_type]['y_offset']
         self.rect = self.image.get_rect(midbottom=soil.rect.midbottom + pygame.math.Vector2(0, self.y_offset))
         self.z = LAYERS['ground plant']
 
-    def grow(self):
-        if self.check_watered(self.rect.center):
-            self.age += self.grow_speed
-
-            if int(self.age) > 0:
-                self.z = LAYERS['main']
-                self.hitbox = self.rect.copy().inflate(-26, -self.rect.height * 0.4)
-
-            if self.age >= self.max_age:
-                self.age = self.max_age
-                self.harvestable = True
-
-            self.image = self.frames[int(self.age)]
-            self.rect = self.image.get_rect(midbottom=self.soil.rect.midbottom + pygame.math.Vector2(0, self.y_offset))
+    # 生长阶段变化后同步贴图、位置和碰撞盒
+    def sync(self, age):
+        self.age = age
+        if age >= self.max_age:
+            self.age = self.max_age
+            self.harvestable = True
+
+        self.image = self.frames[int(self.age)]
+        self.rect = self.image.get_rect(midbottom=self.soil.rect.midbottom + pygame.math.Vector2(0, self.y_offset))
+        if int(self.age) > 0:
+            self.z = LAYERS['main']
+            self.hitbox = self.rect.copy().inflate(-26, -self.rect.height * 0.4)
+        # 通知相机和空间索引重新定位
+        for group in self.groups():
+            if hasattr(group, 'refresh'):
+                group.refresh(self)
+
+
+# 作物生长状态：所有作物的年龄、速度等放在紧凑数组里，每天一次批量推进
+class CropField:
+    def __init__(self, capacity=256):
+        self.cells = np.zeros((capacity, 2), dtype=np.int32)  # 所在格子 (x, y)
+        self.age = np.zeros(capacity)
+        self.speed = np.zeros(capacity)
+        self.max_age = np.zeros(capacity)
+        self.active = np.zeros(capacity, dtype=bool)
+        self.sprites = [None] * capacity
+        self.types = [None] * capacity  # 作物种类（读档后精灵可能还没建好，单独记一份）
+        self.slot_at = {}  # 格子 -> 下标
+        self.free = []  # 空出来的下标
+        self.size = 0  # 用到的最大下标 + 1
+
+    def grow_capacity(self):
+        capacity = len(self.age) * 2
+        self.cells = np.resize(self.cells, (capacity, 2))
+        for name in ('age', 'speed', 'max_age', 'active'):
+            old = getattr(self, name)
+            new = np.zeros(capacity, dtype=old.dtype)
+            new[:len(old)] = old
+            setattr(self, name, new)
+        self.sprites.extend([None] * (capacity - len(self.sprites)))
+        self.types.extend([None] * (capacity - len(self.types)))
+
+    def add(self, plant, cell):
+        if self.free:
+            slot = self.free.pop()
+        else:
+            if self.size == len(self.age):
+                self.grow_capacity()
+            slot = self.size
+            self.size += 1
+        self.cells[slot] = cell
+        self.age[slot] = plant.age
+        self.speed[slot] = GROW_SPEED[plant.plant_type]
+        self.max_age[slot] = plant.max_age
+        self.active[slot] = True
+        self.sprites[slot] = plant
+        self.types[slot] = plant.plant_type
+        self.slot_at[tuple(cell)] = slot
+        plant.slot = slot
+        return slot
+
+    def remove(self, slot):
+        self.active[slot] = False
+        self.sprites[slot] = None
+        self.types[slot] = None
+        del self.slot_at[tuple(self.cells[slot].tolist())]
+        self.free.append(slot)
+
+    # 读档：一次性填满数组，精灵之后再用 attach 补上
+    def load(self, cells, ages, types):
+        n = len(types)
+        while len(self.age) < n:
+            self.grow_capacity()
+        max_age = {name: len(import_folder(CROPS[name]['frames'])) - 1 for name in set(types)}
+        self.cells[:n] = cells
+        self.age[:n] = ages
+        self.speed[:n] = [GROW_SPEED[name] for name in types]
+        self.max_age[:n] = [max_age[name] for name in types]
+        self.active[:n] = True
+        self.types[:n] = types
+        self.slot_at = {(x, y): slot for slot, (x, y) in enumerate(self.cells[:n].tolist())}
+        self.size = n
+
+    def attach(self, plant, slot):
+        self.sprites[slot] = plant
+        plant.slot = slot
+        plant.sync(self.age[slot])
+
+    # 当前所有作物（按下标顺序）：格子、年龄和种类
+    def export(self):
+        slots = np.flatnonzero(self.active[:self.size])
+        return self.cells[slots], self.age[slots], tuple(self.types[slot] for slot in slots)
+
+    # 交给 advance_day 的只读副本
+    def day_state(self, grid, near=None):
+        n = self.size
+        return DayState(frozen(grid), frozen(self.cells[:n]), frozen(self.age[:n]), frozen(self.speed[:n]),
+                        frozen(self.max_age[:n]), frozen(self.active[:n]), near)
+
+    # 合并一天的结果；算的期间被毁掉的作物不算，返回仍然有效的阶段变化下标和成熟下标
+    def apply(self, result):
+        n = len(result.age)
+        keep = self.active[:n]
+        self.age[:n][keep] = result.age[keep]
+        changed = result.changed[keep[result.changed]]
+        ripe = result.ripe[keep[result.ripe]]
+        return changed, ripe
+
+    # 浇过水且没成熟的作物一起长一天；返回生长阶段变了的下标和刚成熟的格子
+    def grow(self, grid):
+        changed, ripe = self.apply(advance_day(self.day_state(grid)))
+        return changed, (self.cells[ripe, 0], self.cells[ripe, 1])
 
 
 class SoilLayer:
@@ -469,283 +1620,491 @@ class SoilLayer:
         self.collision_sprites = collision_sprites
         self.soil_sprites = pygame.sprite.Group()
         self.water_sprites = pygame.sprite.Group()
-        self.plant_sprites = pygame.sprite.Group()
+        self.plant_sprites = SpatialGroup('rect')
+        self.soil_tiles = {}  # (x, y) -> SoilTile
+        self.water_tiles = {}  # (x, y) -> WaterTile
+        self.soil_pool = TilePool(SoilTile, [self.all_sprites, self.soil_sprites])
+        self.water_pool = TilePool(WaterTile, [self.all_sprites, self.water_sprites])
+        self.crops = CropField()
+        self.pending = {}  # 读档后还没建精灵的格子，离玩家近的在前
+        self.stale = {}  # 新一天里阶段变了、精灵还没同步的作物下标，离玩家近的在前
+        self.drying = deque()  # 新一天里还没收走的水瓦片
 
         # graphics
         self.soil_surfs = import_folder_dict('../graphics/soil/')
         self.water_surfs = import_folder('../graphics/soil_water')
 
         self.create_soil_grid()
-        self.create_hit_rects()
-
-        # sounds
-        self.hoe_sound = pygame.mixer.Sound('../audio/hoe.wav')
-        self.hoe_sound.set_volume(0.1)
-
-        self.plant_sound = pygame.mixer.Sound('../audio/plant.wav')
-        self.plant_sound.set_volume(0.2)
 
     def create_soil_grid(self):
-        ground = pygame.image.load('../graphics/world/ground.png')
-        h_tiles, v_tiles = ground.get_width() // TILE_SIZE, ground.get_height() // TILE_SIZE
-
-        self.grid = [[[] for col in range(h_tiles)] for row in range(v_tiles)]
-        for x, y, _ in load_pygame('../data/map.tmx').get_layer_by_name('Farmable').tiles():
-            self.grid[y][x].append('F')
-
-    def create_hit_rects(self):
-        self.hit_rects = []
-        for index_row, row in enumerate(self.grid):
-            for index_col, cell in enumerate(row):
-                if 'F' in cell:
-                    x = index_col * TILE_SIZE
-                    y = index_row * TILE_SIZE
-                    rect = pygame.Rect(x, y, TILE_SIZE, TILE_SIZE)
-                    self.hit_rects.append(rect)
+        tmx_data = load_map()
+        h_tiles, v_tiles = tmx_data.width, tmx_data.height
 
-    def get_hit(self, point):
-        for rect in self.hit_rects:
-            if rect.collidepoint(point):
-                self.hoe_sound.play()
+        # 每格一个字节的状态位（SOIL_FARMABLE 等），批量操作直接用 numpy 向量化
+        self.grid = np.zeros((v_tiles, h_tiles), dtype=np.uint8)
+        for x, y, _ in tmx_data.get_layer_by_name('Farmable').tiles():
+            self.grid[y, x] |= SOIL_FARMABLE
 
-                x = rect.x // TILE_SIZE
-                y = rect.y // TILE_SIZE
+    # 坐标 -> 网格格子，超出地图返回 None
+    def get_cell(self, pos):
+        x = int(pos[0] // TILE_SIZE)
+        y = int(pos[1] // TILE_SIZE)
+        if 0 <= y < self.grid.shape[0] and 0 <= x < self.grid.shape[1]:
+            return x, y
+        return None
 
-                if 'F' in self.grid[y][x]:
-                    self.grid[y][x].append('X')
-                    self.create_soil_tiles()
+    def has_flag(self, x, y, flag):
+        return 0 <= y < self.grid.shape[0] and 0 <= x < self.grid.shape[1] and bool(self.grid[y, x] & flag)
 
-    def water(self, target_pos):
-        for soil_sprite in self.soil_sprites.sprites():
-            if soil_sprite.rect.collidepoint(target_pos):
-                x = soil_sprite.rect.x // TILE_SIZE
-                y = soil_sprite.rect.y // TILE_SIZE
-                self.grid[y][x].append('W')
-
-                pos = soil_sprite.rect.topleft
-                surf = choice(self.water_surfs)
-                WaterTile(pos, surf, [self.all_sprites, self.water_sprites])
+    def get_hit(self, point):
+        cell = self.get_cell(point)
+        if cell and self.has_flag(*cell, SOIL_FARMABLE):
+            sounds.play('hoe')
+            if not self.has_flag(*cell, SOIL_TILLED):
+                self.till(*cell)
 
-    def remove_water(self):
-        # destroy all water sprites
-        for sprite in self.water_sprites.sprites():
-            sprite.kill()
+    # 已经浇过水的格子什么都不做
+    def water(self, target_pos):
+        cell = self.get_cell(target_pos)
+        if cell and self.has_flag(*cell, SOIL_TILLED) and not self.has_flag(*cell, SOIL_WATERED):
+            self.ensure_cell(cell)
+            x, y = cell
+            self.grid[y, x] |= SOIL_WATERED
+            self.add_water(cell)
+
+    def add_water(self, cell):
+        pos = self.soil_tiles[cell].rect.topleft
+        self.water_tiles[cell] = self.water_pool.acquire(pos, choice(self.water_surfs))
+
+    # order：先收走哪些格子的水（离玩家近的在前）；defer 时瓦片留到之后的模拟步里分批收走
+    def remove_water(self, order=(), defer=False):
+        # water sprites go back to the pool
+        if defer:
+            for cell in order:
+                tile = self.water_tiles.pop(cell, None)
+                if tile:
+                    self.drying.append(tile)
+            self.drying.extend(self.water_tiles.values())
+        else:
+            for tile in self.water_tiles.values():
+                self.water_pool.release(tile)
+        self.water_tiles = {}
 
         # clean up the grid
-        for row in self.grid:
-            for cell in row:
-                if 'W' in cell:
-                    cell.remove('W')
-
-    def check_watered(self, pos):
-        x = pos[0] // TILE_SIZE
-        y = pos[1] // TILE_SIZE
-        cell = self.grid[y][x]
-        is_watered = 'W' in cell
-        return is_watered
+        self.grid &= ~np.uint8(SOIL_WATERED)
 
     def plant_seed(self, target_pos, seed):
-        for soil_sprite in self.soil_sprites.sprites():
-            if soil_sprite.rect.collidepoint(target_pos):
-                self.plant_sound.play()
-
-                x = soil_sprite.rect.x // TILE_SIZE
-                y = soil_sprite.rect.y // TILE_SIZE
+        cell = self.get_cell(target_pos)
+        if cell and self.has_flag(*cell, SOIL_TILLED):
+            self.ensure_cell(cell)
+            sounds.play('plant')
+
+            x, y = cell
+            if not self.grid[y, x] & SOIL_PLANTED:
+                self.grid[y, x] |= SOIL_PLANTED
+                plant = Plant(seed, [self.all_sprites, self.plant_sprites, self.collision_sprites], self.soil_tiles[cell])
+                self.crops.add(plant, cell)
+
+    # 作物被收获或被毁掉后清除格子上的种植标记
+    def remove_plant(self, plant):
+        self.stale.pop(plant.slot, None)
+        self.crops.remove(plant.slot)
+        x, y = self.get_cell(plant.soil.rect.center)
+        self.grid[y, x] &= ~np.uint8(SOIL_PLANTED | SOIL_HARVESTABLE)
+
+    # 批量统计
+    def count_cells(self, flag):
+        return int(np.count_nonzero(self.grid & flag))
+
+    def harvestable_cells(self):
+        return [(int(x), int(y)) for y, x in np.argwhere(self.grid & SOIL_HARVESTABLE)]
+
+    # 合并一天的结果：数组和网格立即更新；defer 时精灵同步和收水留给 sync_stale 分批做
+    def apply_day(self, result, defer=False):
+        changed, ripe = self.crops.apply(result)
+        self.grid[self.crops.cells[ripe, 1], self.crops.cells[ripe, 0]] |= SOIL_HARVESTABLE
+        self.remove_water(map(tuple, result.dried.tolist()), defer)
+        if defer:
+            self.stale.update(dict.fromkeys(changed.tolist()))
+            return
+        for slot in changed:
+            plant = self.crops.sprites[slot]
+            if plant:  # 还没重建的作物等重建时再同步
+                plant.sync(self.crops.age[slot])
+
+    # 玩家碰到的作物立即同步
+    def ensure_synced(self, plant):
+        if plant.slot in self.stale:
+            del self.stale[plant.slot]
+            plant.sync(self.crops.age[plant.slot])
+
+    def sync_stale(self, budget=SYNC_PER_FRAME):
+        released = min(budget, len(self.drying))
+        for _ in range(released):
+            self.water_pool.release(self.drying.popleft())
+        budget -= released
+        for _ in range(min(budget, len(self.stale))):
+            slot = next(iter(self.stale))
+            del self.stale[slot]
+            plant = self.crops.sprites[slot]
+            if plant:
+                plant.sync(self.crops.age[slot])
+
+    def is_tilled(self, x, y):
+        return self.has_flag(x, y, SOIL_TILLED)
+
+    # 单格耕地贴图：四个邻居的位掩码查表，已有的瓦片直接换图
+    def update_soil_tile(self, x, y):
+        if not self.is_tilled(x, y):
+            return
+        mask = (self.is_tilled(x, y - 1) | self.is_tilled(x + 1, y) << 1 |
+                self.is_tilled(x, y + 1) << 2 | self.is_tilled(x - 1, y) << 3)
+        surf = self.soil_surfs[SOIL_AUTOTILE[mask]]
+        tile = self.soil_tiles.get((x, y))
+        if tile is None:
+            self.soil_tiles[(x, y)] = self.soil_pool.acquire((x * TILE_SIZE, y * TILE_SIZE), surf)
+        else:
+            tile.image = surf
 
-                if 'P' not in self.grid[y][x]:
-                    self.grid[y][x].append('P')
-                    Plant(seed, [self.all_sprites, self.plant_sprites, self.collision_sprites], soil_sprite,
-                          self.check_watered)
+    # 耕一格只影响自己和上下左右四格
+    def till(self, x, y):
+        self.grid[y, x] |= SOIL_TILLED
+        for dx, dy in ((0, 0), (0, -1), (1, 0), (0, 1), (-1, 0)):
+            self.update_soil_tile(x + dx, y + dy)
 
-    def update_plants(self):
+    # 整张网格重新拼接（一次性建立所有耕地瓦片）
+    def create_soil_tiles(self):
+        for y, x in np.argwhere(self.grid & SOIL_TILLED):
+            self.update_soil_tile(int(x), int(y))
+
+    # 读档：换上存档里的网格和作物，精灵按离 near 的距离排队，之后分帧重建
+    def restore(self, grid, crop_cells, crop_ages, crop_types, near):
+        self.remove_water()
+        while self.drying:
+            self.water_pool.release(self.drying.popleft())
+        self.stale = {}
+        for tile in self.soil_tiles.values():
+            self.soil_pool.release(tile)
+        self.soil_tiles = {}
         for plant in self.plant_sprites.sprites():
-            plant.grow()
+            plant.kill()
+        self.grid = np.array(grid, dtype=np.uint8)
+        self.crops = CropField(max(256, len(crop_types)))
+        self.crops.load(crop_cells, crop_ages, crop_types)
+
+        cells = np.argwhere(self.grid & SOIL_TILLED)
+        distance = (cells[:, 1] - near[0] // TILE_SIZE) ** 2 + (cells[:, 0] - near[1] // TILE_SIZE) ** 2
+        self.pending = {(x, y): None for y, x in cells[np.argsort(distance, kind='stable')].tolist()}
+
+    # 重建一格的精灵：耕地瓦片、水和作物
+    def build_cell(self, cell):
+        x, y = cell
+        self.update_soil_tile(x, y)
+        if self.grid[y, x] & SOIL_WATERED:
+            self.add_water(cell)
+        slot = self.crops.slot_at.get(cell)
+        if slot is not None:
+            plant = Plant(self.crops.types[slot], [self.all_sprites, self.plant_sprites, self.collision_sprites],
+                          self.soil_tiles[cell])
+            self.crops.attach(plant, slot)
+
+    # 玩家要操作的格子立即重建
+    def ensure_cell(self, cell):
+        if cell in self.pending:
+            del self.pending[cell]
+            self.build_cell(cell)
+
+    def build_pending(self, budget=REBUILD_PER_FRAME):
+        for _ in range(min(budget, len(self.pending))):
+            cell = next(iter(self.pending))
+            del self.pending[cell]
+            self.build_cell(cell)
+
+
+# 每日模拟----------------------------------------------------------
+# 一天的输入和结果都是只读数组，可以放心交给后台线程；near 是玩家位置，结果按离它的距离排好
+DayState = namedtuple('DayState', ['grid', 'cells', 'age', 'speed', 'max_age', 'active', 'near'])
+DayResult = namedtuple('DayResult', ['age', 'changed', 'ripe', 'dried'])
+
+
+# 浇过水且没成熟的作物一起长一天（不改输入）：新年龄、阶段变了的下标、刚成熟的下标和要收水的格子
+def advance_day(state):
+    xs, ys = state.cells[:, 0], state.cells[:, 1]
+    growing = state.active & ((state.grid[ys, xs] & SOIL_WATERED) > 0) & (state.age < state.max_age)
+    age = state.age.copy()
+    age[growing] = np.minimum(age[growing] + state.speed[growing], state.max_age[growing])
+    changed = np.flatnonzero(growing & (age.astype(np.int64) != state.age.astype(np.int64)))
+    ripe = np.flatnonzero(growing & (age >= state.max_age))
+    dried = np.argwhere(state.grid & SOIL_WATERED)[:, ::-1]
+    if state.near is not None:
+        x, y = state.near[0] // TILE_SIZE, state.near[1] // TILE_SIZE
+        changed = changed[np.argsort((xs[changed] - x) ** 2 + (ys[changed] - y) ** 2, kind='stable')]
+        dried = dried[np.argsort((dried[:, 0] - x) ** 2 + (dried[:, 1] - y) ** 2, kind='stable')]
+    return DayResult(frozen(age), frozen(changed), frozen(ripe), frozen(dried))
+
+
+# 入夜时提交当天的状态，后台线程算下一天；新一天开始时取结果（还没算完就等）
+class WorldSimulation:
+    def __init__(self, threaded=SIMULATION_WORKER):
+        self.threaded = threaded
+        self.thread = None
+        self.result = None
+        self.submitted = False
+
+    def run(self, state):
+        self.result = advance_day(state)
+
+    def submit(self, state):
+        self.submitted = True
+        if self.threaded:
+            self.thread = threading.Thread(target=self.run, args=(state,), daemon=True)
+            self.thread.start()
+        else:
+            self.run(state)
 
-    def create_soil_tiles(self):
-        self.soil_sprites.empty()
-        for index_row, row in enumerate(self.grid):
-            for index_col, cell in enumerate(row):
-                if 'X' in cell:
-
-                    # tile options
-                    t = 'X' in self.grid[index_row - 1][index_col]
-                    b = 'X' in self.grid[index_row + 1][index_col]
-                    r = 'X' in row[index_col + 1]
-                    l = 'X' in row[index_col - 1]
-
-                    tile_type = 'o'
-
-                    # all sides
-                    if all((t, r, b, l)): tile_type = 'x'
-
-                    # horizontal tiles only
-                    if l and not any((t, r, b)): tile_type = 'r'
-                    if r and not any((t, l, b)): tile_type = 'l'
-                    if r and l and not any((t, b)): tile_type = 'lr'
-
-                    # vertical only
-                    if t and not any((r, l, b)): tile_type = 'b'
-                    if b and not any((r, l, t)): tile_type = 't'
-                    if b and t and not any((r, l)): tile_type = 'tb'
-
-                    # corners
-                    if l and b and not any((t, r)): tile_type = 'tr'
-                    if r and b and not any((t, l)): tile_type = 'tl'
-                    if l and t and not any((b, r)): tile_type = 'br'
-                    if r and t and not any((b, l)): tile_type = 'bl'
-
-                    # T shapes
-                    if all((t, b, r)) and not l: tile_type = 'tbr'
-                    if all((t, b, l)) and not r: tile_type = 'tbl'
-                    if all((l, r, t)) and not b: tile_type = 'lrb'
-                    if all((l, r, b)) and not t: tile_type = 'lrt'
-
-                    SoilTile(
-                        pos=(index_col * TILE_SIZE, index_row * TILE_SIZE),
-                        surf=self.soil_surfs[tile_type],
-                        groups=[self.all_sprites, self.soil_sprites])
+    def take(self):
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+        result, self.result = self.result, None
+        self.submitted = False
+        return result
 
 
 # 天空--------------------------------------------------------------
 class Sky:
     def __init__(self):
-        self.display_surface = pygame.display.get_surface()
-        self.full_surf = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT))
         self.start_color = [255, 255, 255]
         self.end_color = (38, 101, 189)
 
-    def display(self, dt):
+    def update(self, dt):
         for index, value in enumerate(self.end_color):
             if self.start_color[index] > value:
                 self.start_color[index] -= 2 * dt
 
-        self.full_surf.fill(self.start_color)
-        self.display_surface.blit(self.full_surf, (0, 0), special_flags=pygame.BLEND_RGBA_MULT)
+
+# 全屏调色：几种调色的颜色先相乘，再做一次乘法混合-----------------------------
+# 纯白时不做任何事；颜色按 TINT_QUANTUM 量化，量化后没变就不重新填充
+class TintPass:
+    def __init__(self, quantum=TINT_QUANTUM):
+        self.display_surface = pygame.display.get_surface()
+        self.surf = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT))
+        self.quantum = quantum
+        self.color = None  # 表面里当前填充的颜色
+
+    # 以白色为基准向下量化，接近白色的细微变化仍然算作白色
+    def quantize(self, value):
+        return 255 - (255 - max(0, min(255, int(value)))) // self.quantum * self.quantum
+
+    # 几个调色相乘后量化的结果
+    def resolve(self, *tints):
+        color = [255.0, 255.0, 255.0]
+        for tint in tints:
+            for index in range(3):
+                color[index] = color[index] * tint[index] / 255
+        return tuple(self.quantize(value) for value in color)
+
+    def display(self, *tints):
+        color = self.resolve(*tints)
+        if color == (255, 255, 255):
+            return
+        if color != self.color:
+            self.surf.fill(color)
+            self.color = color
+        self.display_surface.blit(self.surf, (0, 0), special_flags=pygame.BLEND_RGBA_MULT)
+
+    # 只调暗几块圆角区域：区域里圆角以外的部分乘白色，保持不变
+    def display_panels(self, panels, *tints):
+        color = self.resolve(*tints)
+        if color == (255, 255, 255):
+            return
+        for rect, radius in panels:
+            surf = pygame.Surface(rect.size)
+            surf.fill('white')
+            pygame.draw.rect(surf, color, surf.get_rect(), border_radius=radius)
+            self.display_surface.blit(surf, rect, special_flags=pygame.BLEND_RGBA_MULT)
 
 
 # 商店交易-----------------------------------------------------
 class Menu:
-    def __init__(self, player, toggle_menu):
+    def __init__(self, player, toggle_menu, catalog=SHOP_CATALOG, page_rows=SHOP_PAGE_ROWS):
         self.player = player
         self.toggle_menu = toggle_menu
         self.display_surface = pygame.display.get_surface()
-        self.font = pygame.font.Font('../font/ChangBanDianSong-12.ttf', 30)
+        self.font = text_cache.font(30)
         # 选择区块样式
         self.width = 400
         self.space = 10
         self.padding = 8
-        # 条目设置
-        self.options = list(self.player.item_inventory.keys()) + list(self.player.seed_inventory.keys())
-        self.sell_border = len(self.player.item_inventory) - 1
+        self.page_rows = page_rows
+        # 条目按分类分组，分类顺序为目录里第一次出现的顺序
+        self.categories = {}
+        for entry in catalog:
+            self.categories.setdefault(entry['category'], []).append(entry)
+        self.category_names = list(self.categories)
+        self.category = 0
+        self.options = self.categories[self.category_names[0]] if catalog else []
+        self.rows = OrderedDict()  # (物品, 买卖) -> ((价格, 数目), 行表面)，只留最近用过的几页
+        self.max_rows = page_rows * 3
         self.setup()
         # 选择器
         self.index = 0
         self.timer = Timer(200)
 
+    def setup(self):
+        self.row_height = self.font.get_height() + self.padding * 2
+        self.total_height = self.page_rows * self.row_height + (self.page_rows - 1) * self.space
+        self.menu_top = SCREEN_HEIGHT / 2 - self.total_height / 2
+        self.main_rect = pygame.Rect(SCREEN_WIDTH / 2 - self.width / 2, self.menu_top, self.width, self.total_height)
+        self.tabs_rect = pygame.Rect(self.main_rect.left, self.main_rect.top - self.row_height - self.space,
+                                     self.width, self.row_height)
+        self.pager_rect = pygame.Rect(self.main_rect.left, self.main_rect.bottom + self.space, self.width, 30)
+        # 购买、出售文字
+        self.buy_text = self.font.render('购买', False, 'Blue')
+        self.sell_text = self.font.render('出售', False, 'Green')
+
+    # 价格表优先（调参时会原地修改），表里没有的用目录里的价格
+    def price(self, entry):
+        prices = SALE_PRICES if entry['action'] == 'sell' else PURCHASE_PRICES
+        return prices.get(entry['item'], entry['price'])
+
+    def amount(self, entry):
+        inventory = self.player.item_inventory if entry['action'] == 'sell' else self.player.seed_inventory
+        return inventory.get(entry['item'], 0)
+
+    # 当前页：(条目下标, 条目)
+    def page_entries(self):
+        first = self.index // self.page_rows * self.page_rows
+        return list(enumerate(self.options[first:first + self.page_rows], first))
+
+    # 影响画面的状态，和上一帧一样就不用重画
+    def state(self):
+        return (self.category, self.index, self.player.money,
+                tuple((self.price(entry), self.amount(entry)) for _, entry in self.page_entries()))
+
+    # 商店画面占的区域（分类、条目、页码和金钱框）
+    def bounds(self):
+        text_surf = text_cache.render(f'${self.player.money}', 'Black', 30, False)
+        money_rect = text_surf.get_rect(midbottom=(SCREEN_WIDTH / 2, SCREEN_HEIGHT - 20)).inflate(10, 10)
+        return self.main_rect.unionall([self.tabs_rect, self.pager_rect, money_rect])
+
     def display_money(self):
-        text_surf = self.font.render(f'${self.player.money}', False, 'Black')
+        text_surf = text_cache.render(f'${self.player.money}', 'Black', 30, False)
         text_rect = text_surf.get_rect(midbottom=(SCREEN_WIDTH / 2, SCREEN_HEIGHT - 20))
 
         pygame.draw.rect(self.display_surface, 'White', text_rect.inflate(10, 10), 0,
                          4)  # 绘制选择框，文字区域扩大10后的区域，0：填充实心，圆角半径4
         self.display_surface.blit(text_surf, text_rect)
 
-    def setup(self):
-        # 计算菜单总高度
-        self.text_surfs = []
-        self.total_height = 0
-
-        for item in self.options:
-            if item == 'corn':
-                item = '玉米'
-            elif item == 'tomato':
-                item = '西红柿'
-            elif item == 'apple':
-                item = '苹果'
-            text_surf = self.font.render(item, False, 'Black')
-            self.text_surfs.append(text_surf)
-            self.total_height += text_surf.get_height() + (self.padding * 2)
-        self.total_height += (len(self.text_surfs) - 1) * self.space
-        self.menu_top = SCREEN_HEIGHT / 2 - self.total_height / 2
-        self.main_rect = pygame.Rect(SCREEN_WIDTH / 2 - self.width / 2, self.menu_top, self.width, self.total_height)
-        # 购买、出售文字
-        self.buy_text = self.font.render('购买', False, 'Blue')
-        self.sell_text = self.font.render('出售', False, 'Green')
+    def select_category(self, category):
+        self.category = category % len(self.category_names)
+        self.options = self.categories[self.category_names[self.category]]
+        self.index = 0
 
-    # 键盘控制选择、买卖、退出
+    # 键盘控制选择、翻分类、买卖、退出
     def input(self):
-        keys = pygame.key.get_pressed()
+        keys = controls.keys
         self.timer.update()
         if keys[pygame.K_ESCAPE]:
             self.toggle_menu()
-        if not self.timer.active:
+        if not self.timer.active and self.options:
             if keys[pygame.K_UP]:
                 self.index -= 1
                 self.timer.activate()
             if keys[pygame.K_DOWN]:
                 self.index += 1
                 self.timer.activate()
+            if keys[pygame.K_LEFT]:
+                self.select_category(self.category - 1)
+                self.timer.activate()
+            if keys[pygame.K_RIGHT]:
+                self.select_category(self.category + 1)
+                self.timer.activate()
             if keys[pygame.K_SPACE]:
                 self.timer.activate()
                 # 获取当前物品
-                current_item = self.options[self.index]
-                # 卖
-                if self.index <= self.sell_border:
-                    if self.player.item_inventory[current_item] > 0:
-                        self.player.item_inventory[current_item] -= 1
-                        self.player.money += SALE_PRICES[current_item]
-                # 买
+                current = self.options[self.index]
+                if current['action'] == 'sell':
+                    self.player.sell(current['item'])
                 else:
-                    seed_price = PURCHASE_PRICES[current_item]
-                    if self.player.money >= seed_price:
-                        self.player.seed_inventory[current_item] += 1
-                        self.player.money -= PURCHASE_PRICES[current_item]
+                    self.player.buy(current['item'])
         # 选择器循环
         if self.index < 0:
             self.index = len(self.options) - 1
         if self.index > len(self.options) - 1:
             self.index = 0
 
-    def show_entry(self, text_surf, amount, top, selected):
-        # 背景
-        bg_rect = pygame.Rect(self.main_rect.left, top, self.width, text_surf.get_height() + (self.padding * 2))
-        pygame.draw.rect(self.display_surface, 'White', bg_rect, 0, 4)
+    # 一行的表面：价格和数目都没变就直接用缓存
+    def row_surface(self, entry):
+        name = (entry['item'], entry['action'])
+        key = (self.price(entry), self.amount(entry))
+        cached = self.rows.get(name)
+        if cached and cached[0] == key:
+            self.rows.move_to_end(name)
+            return cached[1]
+        surf = pygame.Surface((self.width, self.row_height), pygame.SRCALPHA)
+        pygame.draw.rect(surf, 'White', surf.get_rect(), 0, 4)
+        centery = self.row_height / 2
         # 文本
-        text_rect = text_surf.get_rect(midleft=(self.main_rect.left + 20, bg_rect.centery))
-        self.display_surface.blit(text_surf, text_rect)
-        # 数目
-        amount_surf = self.font.render(str(amount), False, 'Black')
-        amount_rect = amount_surf.get_rect(midright=(self.main_rect.right - 20, bg_rect.centery))
-        self.display_surface.blit(amount_surf, amount_rect)
+        text_surf = text_cache.render(entry['label'], 'Black', 30, False)
+        surf.blit(text_surf, text_surf.get_rect(midleft=(20, centery)))
+        # 价格和数目
+        price_surf = text_cache.render(f'${key[0]}', (90, 90, 90), 30, False)
+        surf.blit(price_surf, price_surf.get_rect(midright=(self.width - 90, centery)))
+        amount_surf = text_cache.render(str(key[1]), 'Black', 30, False)
+        surf.blit(amount_surf, amount_surf.get_rect(midright=(self.width - 20, centery)))
+        self.rows[name] = (key, surf)
+        self.rows.move_to_end(name)
+        if len(self.rows) > self.max_rows:
+            self.rows.popitem(last=False)
+        return surf
+
+    def show_entry(self, entry, top, selected):
+        bg_rect = pygame.Rect(self.main_rect.left, top, self.width, self.row_height)
+        self.display_surface.blit(self.row_surface(entry), bg_rect)
         # 选择框
         if selected:
             pygame.draw.rect(self.display_surface, 'black', bg_rect, 4, 4)
-            if self.index <= self.sell_border:  # sell
-                pos_rect = self.sell_text.get_rect(midleft=(self.main_rect.left + 150, bg_rect.centery))
-                self.display_surface.blit(self.sell_text, pos_rect)
-            else:  # buy
-                pos_rect = self.buy_text.get_rect(midleft=(self.main_rect.left + 150, bg_rect.centery))
-                self.display_surface.blit(self.buy_text, pos_rect)
-
-    def update(self):
-        self.input()
+            text = self.sell_text if entry['action'] == 'sell' else self.buy_text
+            pos_rect = text.get_rect(midleft=(self.main_rect.left + 150, bg_rect.centery))
+            self.display_surface.blit(text, pos_rect)
+
+    def display_tabs(self):
+        width = self.width // len(self.category_names)
+        for index, name in enumerate(self.category_names):
+            tab_rect = pygame.Rect(self.tabs_rect.left + index * width, self.tabs_rect.top, width - 4, self.row_height)
+            pygame.draw.rect(self.display_surface, 'White' if index == self.category else (170, 170, 170), tab_rect, 0, 4)
+            text_surf = text_cache.render(name, 'Black', 30, False)
+            self.display_surface.blit(text_surf, text_surf.get_rect(center=tab_rect.center))
+
+    def display_pager(self):
+        pages = max(1, -(-len(self.options) // self.page_rows))
+        text_surf = text_cache.render(f'{self.index // self.page_rows + 1}/{pages}', 'White', 24, False)
+        self.display_surface.blit(text_surf, text_surf.get_rect(center=self.pager_rect.center))
+
+    # 只画当前页的行
+    def display(self):
         self.display_money()
-        for text_index, text_surf in enumerate(self.text_surfs):
-            top = self.main_rect.top + text_index * (text_surf.get_height() + (self.padding * 2) + self.space)
-            amount_list = list(self.player.item_inventory.values()) + list(self.player.seed_inventory.values())
-            amount = amount_list[text_index]
-            self.show_entry(text_surf, amount, top, self.index == text_index)
+        if not self.options:
+            return
+        self.display_tabs()
+        for slot, (index, entry) in enumerate(self.page_entries()):
+            top = self.main_rect.top + slot * (self.row_height + self.space)
+            self.show_entry(entry, top, index == self.index)
+        self.display_pager()
 
 
 # 成就系统----------------------------------------------------
 class AchievementSystem:
     def __init__(self):
         self.display_surface = pygame.display.get_surface()
-        self.font = pygame.font.Font('../font/ChangBanDianSong-12.ttf', 28)
+        self.font = text_cache.font(28)
         self.achievements = []
         self.harvest_count = 0
         self.visible = False
         self.button_rect = pygame.Rect(SCREEN_WIDTH - 120, 20, 100, 40)  # 右上角按钮
+        self.popup_rect = pygame.Rect(SCREEN_WIDTH // 2 - 180, 40, 360, 60)
+        self.panel_rect = pygame.Rect(SCREEN_WIDTH / 2 - 200, SCREEN_HEIGHT / 2 - 150, 400, 300)
         # 弹窗
         self.popup_text = None
         self.popup_start_time = 0
@@ -757,65 +2116,238 @@ class AchievementSystem:
         if self.harvest_count == 1 and "萌芽！" not in self.achievements:
             self.achievements.append("萌芽！")
             self.popup_text = "成就达成：萌芽！"
-            self.popup_start_time = pygame.time.get_ticks()
+            self.popup_start_time = game_clock.ticks()
         # 收获20次成就
         if self.harvest_count == 20 and "收获小能手！" not in self.achievements:
             self.achievements.append("收获小能手！")
             self.popup_text = "成就达成：收获小能手！"
-            self.popup_start_time = pygame.time.get_ticks()
+            self.popup_start_time = game_clock.ticks()
         # 收获50次成就
         if self.harvest_count == 50 and "大丰收！" not in self.achievements:
             self.achievements.append("大丰收！")
             self.popup_text = "成就达成：大丰收！"
-            self.popup_start_time = pygame.time.get_ticks()
+            self.popup_start_time = game_clock.ticks()
+
+    def popup_visible(self):
+        return bool(self.popup_text) and game_clock.ticks() - self.popup_start_time < self.popup_duration
+
+    def state(self):
+        return self.visible, self.popup_visible() and self.popup_text, len(self.achievements)
+
+    # 按钮、弹窗和成就页面合起来的区域
+    def bounds(self):
+        return self.button_rect.unionall([self.popup_rect, self.panel_rect])
+
+    # 当前画着的弹窗和成就页面：(区域, 圆角半径)
+    def panels(self):
+        panels = []
+        if self.popup_visible():
+            panels.append((self.popup_rect, 12))
+        if self.visible:
+            panels.append((self.panel_rect, 12))
+        return panels
 
     def draw_button(self):
         pygame.draw.rect(self.display_surface, (200, 220, 255), self.button_rect, border_radius=8)
-        text = self.font.render("成就", True, (0, 0, 0))
+        text = text_cache.render("成就", (0, 0, 0), 28)
         text_rect = text.get_rect(center=self.button_rect.center)
         self.display_surface.blit(text, text_rect)
 
-    def handle_event(self, event):
-        if event.type == pygame.MOUSEBUTTONDOWN and event.button == 1:
-            if self.button_rect.collidepoint(event.pos):
-                self.visible = not self.visible
+    def click(self, pos):
+        if self.button_rect.collidepoint(pos):
+            self.visible = not self.visible
 
     def display(self):
         # 弹窗显示
         if self.popup_text:
-            now = pygame.time.get_ticks()
+            now = game_clock.ticks()
             if now - self.popup_start_time < self.popup_duration:
-                popup_rect = pygame.Rect(SCREEN_WIDTH // 2 - 180, 40, 360, 60)
-                pygame.draw.rect(self.display_surface, (255, 255, 200), popup_rect, border_radius=12)
-                popup_font = pygame.font.Font('../font/ChangBanDianSong-12.ttf', 32)
-                popup_surf = popup_font.render(self.popup_text, True, (255, 128, 0))
-                popup_text_rect = popup_surf.get_rect(center=popup_rect.center)
+                pygame.draw.rect(self.display_surface, (255, 255, 200), self.popup_rect, border_radius=12)
+                popup_surf = text_cache.render(self.popup_text, (255, 128, 0), 32)
+                popup_text_rect = popup_surf.get_rect(center=self.popup_rect.center)
                 self.display_surface.blit(popup_surf, popup_text_rect)
             else:
                 self.popup_text = None  # 超时后清除弹窗
 
         if self.visible:
-            bg_rect = pygame.Rect(SCREEN_WIDTH / 2 - 200, SCREEN_HEIGHT / 2 - 150, 400, 300)
+            bg_rect = self.panel_rect
             pygame.draw.rect(self.display_surface, (255, 255, 255), bg_rect, border_radius=12)
-            title = self.font.render("成就记录", True, (38, 101, 189))
+            title = text_cache.render("成就记录", (38, 101, 189), 28)
             self.display_surface.blit(title, (bg_rect.x + 120, bg_rect.y + 20))
             for idx, ach in enumerate(self.achievements):
-                ach_text = self.font.render(ach, True, (0, 128, 0))
+                ach_text = text_cache.render(ach, (0, 128, 0), 28)
                 self.display_surface.blit(ach_text, (bg_rect.x + 40, bg_rect.y + 80 + idx * 40))
             if not self.achievements:
-                no_text = self.font.render("暂无成就", True, (128, 128, 128))
+                no_text = text_cache.render("暂无成就", (128, 128, 128), 28)
                 self.display_surface.blit(no_text, (bg_rect.x + 120, bg_rect.y + 120))
 
 
+# 存档------------------------------------------------------------
+SAVE_MAGIC = b'KSAV'
+SAVE_VERSION = 1
+SAVE_HEADER = struct.Struct('<4sH')  # 魔数、版本，后面是 zlib 压缩的内容
+
+# 某一刻的世界状态：全部是元组、字符串和只读数组，可以放心交给后台线程
+WorldSnapshot = namedtuple('WorldSnapshot', ['day', 'money', 'position', 'items', 'seeds', 'achievements',
+                                             'harvest_count', 'grid', 'crop_cells', 'crop_ages', 'crop_types'])
+
+
+def frozen(values):
+    values = np.array(values)
+    values.setflags(write=False)
+    return values
+
+
+def write_counts(out, counts):
+    out += struct.pack('<H', len(counts))
+    for name, amount in counts:
+        write_str(out, name)
+        out += struct.pack('<i', amount)
+
+
+def read_counts(data, offset):
+    count, = struct.unpack_from('<H', data, offset)
+    offset += 2
+    counts = []
+    for _ in range(count):
+        name, offset = read_str(data, offset)
+        amount, = struct.unpack_from('<i', data, offset)
+        counts.append((name, amount))
+        offset += 4
+    return tuple(counts), offset
+
+
+def encode_save(snapshot):
+    out = bytearray(struct.pack('<Iidd', snapshot.day, snapshot.money, *snapshot.position))
+    write_counts(out, snapshot.items)
+    write_counts(out, snapshot.seeds)
+    out += struct.pack('<H', len(snapshot.achievements))
+    for name in snapshot.achievements:
+        write_str(out, name)
+    out += struct.pack('<I', snapshot.harvest_count)
+    # 网格：每格一个字节
+    out += struct.pack('<HH', *snapshot.grid.shape)
+    out += snapshot.grid.astype(np.uint8).tobytes()
+    # 作物：种类表 + 三个定长数组
+    names = sorted(set(snapshot.crop_types))
+    if len(names) > 0x100:
+        raise ValueError('too many crop types for the save format')
+    out += struct.pack('<H', len(names))
+    for name in names:
+        write_str(out, name)
+    out += struct.pack('<I', len(snapshot.crop_types))
+    out += snapshot.crop_cells.astype('<i4').tobytes()
+    out += snapshot.crop_ages.astype('<f8').tobytes()
+    index = {name: position for position, name in enumerate(names)}
+    out += np.array([index[name] for name in snapshot.crop_types], dtype=np.uint8).tobytes()
+    return SAVE_HEADER.pack(SAVE_MAGIC, SAVE_VERSION) + zlib.compress(out, 6)
+
+
+def decode_save(data):
+    magic, version = SAVE_HEADER.unpack_from(data)
+    if magic != SAVE_MAGIC:
+        raise ValueError('not a save file')
+    if version != SAVE_VERSION:
+        raise ValueError(f'unsupported save version {version}')
+    data = zlib.decompress(data[SAVE_HEADER.size:])
+    day, money, x, y = struct.unpack_from('<Iidd', data)
+    offset = struct.calcsize('<Iidd')
+    items, offset = read_counts(data, offset)
+    seeds, offset = read_counts(data, offset)
+    count, = struct.unpack_from('<H', data, offset)
+    offset += 2
+    achievements = []
+    for _ in range(count):
+        name, offset = read_str(data, offset)
+        achievements.append(name)
+    harvest_count, height, width = struct.unpack_from('<IHH', data, offset)
+    offset += 8
+    grid = np.frombuffer(data, np.uint8, height * width, offset).reshape(height, width)
+    offset += height * width
+    count, = struct.unpack_from('<H', data, offset)
+    offset += 2
+    names = []
+    for _ in range(count):
+        name, offset = read_str(data, offset)
+        names.append(name)
+    count, = struct.unpack_from('<I', data, offset)
+    offset += 4
+    cells = np.frombuffer(data, '<i4', count * 2, offset).reshape(count, 2)
+    offset += count * 8
+    ages = np.frombuffer(data, '<f8', count, offset)
+    offset += count * 8
+    types = tuple(names[index] for index in np.frombuffer(data, np.uint8, count, offset).tolist())
+    return WorldSnapshot(day, money, (x, y), items, seeds, tuple(achievements), harvest_count,
+                         grid, cells, ages, types)
+
+
+class SaveSystem:
+    def __init__(self, path=SAVE_PATH):
+        self.path = path
+        self.thread = None
+
+    # 主线程上复制状态，只有几次数组拷贝
+    def snapshot(self, level):
+        player = level.player
+        cells, ages, types = level.soil_layer.crops.export()
+        return WorldSnapshot(
+            day=level.day_count,
+            money=player.money,
+            position=(player.pos.x, player.pos.y),
+            items=tuple(player.item_inventory.items()),
+            seeds=tuple(player.seed_inventory.items()),
+            achievements=tuple(level.achievement_system.achievements),
+            harvest_count=level.achievement_system.harvest_count,
+            grid=frozen(level.soil_layer.grid),
+            crop_cells=frozen(cells),
+            crop_ages=frozen(ages),
+            crop_types=types)
+
+    # 先写临时文件再替换，写到一半退出也不会弄坏旧存档
+    def write(self, snapshot):
+        folder = os.path.dirname(self.path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        temp = self.path + '.tmp'
+        with open(temp, 'wb') as file:
+            file.write(encode_save(snapshot))
+        os.replace(temp, self.path)
+
+    # 后台存档：上一次还没写完就跳过这次
+    def autosave(self, level):
+        if self.thread and self.thread.is_alive():
+            return False
+        self.thread = threading.Thread(target=self.write, args=(self.snapshot(level),), daemon=True)
+        self.thread.start()
+        return True
+
+    def wait(self):
+        if self.thread:
+            self.thread.join()
+
+    def save(self, level):
+        self.wait()
+        self.write(self.snapshot(level))
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return None
+        with open(self.path, 'rb') as file:
+            return decode_save(file.read())
+
+
 # 功能集合----------------------------------------------------
 class Level:
-    # 初始化
-    def __init__(self):
+    # 初始化（headless：无窗口模拟，不放音乐、不产生特效）
+    def __init__(self, headless=False):
         self.display_surface = pygame.display.get_surface()
+        self.headless = headless
 
         self.all_sprites = CameraGroup()
-        self.collision_sprites = pygame.sprite.Group()
+        self.collision_sprites = SpatialGroup()
         self.interaction_sprites = pygame.sprite.Group()
+        self.particles = ParticlePool(self.all_sprites)
+        self.static_layers = StaticLayerBaker(self.all_sprites, streaming=STREAM_CHUNKS) if BAKE_STATIC_LAYERS else None
 
         self.soil_layer = SoilLayer(self.all_sprites, self.collision_sprites)
         self.day_count = 1  # 天数变量
@@ -827,12 +2359,16 @@ class Level:
         self.shop_active = False
         # 天空
         self.sky = Sky()
+        self.tint = TintPass()
         # 音乐
-        self.success = pygame.mixer.Sound('../audio/success.wav')
-        self.success.set_volume(0.3)
-        self.music = pygame.mixer.Sound('../audio/music.mp3')
-        self.music.play(loops=-1)
+        self.music = None
+        if not headless:
+            self.music = MusicStream()
+            self.music.play()
         self.achievement_system = AchievementSystem()  # 新增成就系统
+        self.saves = SaveSystem()
+        self.autosave = AUTOSAVE and not headless
+        self.simulation = WorldSimulation(SIMULATION_WORKER and not headless)
         # 小游戏相关变量
         self.mini_game_active = False
         self.mini_game_start_time = 0
@@ -845,27 +2381,35 @@ class Level:
         self.mini_game_icon_visible = False
         self.mini_game_icon_flash_time = 0
         self.mini_game_selected_plant = None
+        self.mini_game_state = None
+        # 脏矩形模式：static_key 记录当前静态画面（商店的调色等），变了就整屏重画
+        self.dirty_rects = DIRTY_RECTS
+        self.static_key = None
+        self.hud_visible = profiler.hud_visible
+        self.background = None
+        self.panels = {}
 
     # 初步设置处理tmx文件
     def setup(self):
         # 导入
-        tmx_data = load_pygame('../data/map.tmx')
+        tmx_data = load_map()
         # house
         for layer in ['HouseFloor', 'HouseFurnitureBottom']:
             for x, y, surf in tmx_data.get_layer_by_name(layer).tiles():
-                Generic((x * TILE_SIZE, y * TILE_SIZE), surf, self.all_sprites, LAYERS['house bottom'])
+                self.add_static((x * TILE_SIZE, y * TILE_SIZE), surf, LAYERS['house bottom'])
         for layer in ['HouseWalls', 'HouseFurnitureTop']:
             for x, y, surf in tmx_data.get_layer_by_name(layer).tiles():
-                Generic((x * TILE_SIZE, y * TILE_SIZE), surf, self.all_sprites)
+                self.add_static((x * TILE_SIZE, y * TILE_SIZE), surf)
         # Fence
         for x, y, surf in tmx_data.get_layer_by_name('Fence').tiles():
-            Generic((x * TILE_SIZE, y * TILE_SIZE), surf, [self.all_sprites, self.collision_sprites])
+            self.add_static((x * TILE_SIZE, y * TILE_SIZE), surf, groups=[self.collision_sprites])
         # wildflowers
         for obj in tmx_data.get_layer_by_name('Decoration'):
             WildFlower((obj.x, obj.y), obj.image, [self.all_sprites, self.collision_sprites])
-        # collion tiles
+        # collion tiles（不绘制，只记在位图里）
+        self.collision_map = CollisionMap(tmx_data.width, tmx_data.height, self.collision_sprites.counter)
         for x, y, surf in tmx_data.get_layer_by_name('Collision').tiles():
-            Generic((x * TILE_SIZE, y * TILE_SIZE), pygame.Surface((TILE_SIZE, TILE_SIZE)), self.collision_sprites)
+            self.collision_map.set(x, y)
         # tmx中的对象层
         for obj in tmx_data.get_layer_by_name('Player'):
             if obj.name == 'Start':
@@ -875,76 +2419,127 @@ class Level:
                     collision_sprites=self.collision_sprites,
                     interaction=self.interaction_sprites,
                     soil_layer=self.soil_layer,
-                    toggle_shop=self.toggle_shop)
+                    toggle_shop=self.toggle_shop,
+                    collision_map=self.collision_map)
             if obj.name == 'Bed':
                 Interaction((obj.x, obj.y), (obj.width, obj.height), self.interaction_sprites, obj.name)
             if obj.name == 'Trader':
                 Interaction((obj.x, obj.y), (obj.width, obj.height), self.interaction_sprites, obj.name)
 
-        Generic(
-            pos=(0, 0),
-            surf=pygame.image.load('../graphics/world/ground.png').convert_alpha(),
-            groups=self.all_sprites,
-            z=LAYERS['ground'])
+        ground_path = '../graphics/world/ground.png'
+        if self.static_layers and self.static_layers.streaming:
+            self.add_static((0, 0), StreamedImage(ground_path), LAYERS['ground'])
+        else:
+            self.add_static((0, 0), assets.load(ground_path), LAYERS['ground'])
+
+    # 静态瓦片：开启烘焙时画进分块表面，只在碰撞组里保留不绘制的精灵
+    def add_static(self, pos, surf, z=LAYERS['main'], groups=()):
+        if self.static_layers:
+            self.static_layers.add(pos, surf, z)
+            if groups:
+                Generic(pos, surf, groups, z)
+        else:
+            Generic(pos, surf, [self.all_sprites, *groups], z)
 
     # 玩家物品添加
     def player_add(self, item):
         self.player.item_inventory[item] += 1
-        self.success.play()
+        sounds.play('success')
 
     # 商店
     def toggle_shop(self):
         self.shop_active = not self.shop_active
 
+    # 入夜：把当天的状态交给模拟线程
+    def submit_day(self):
+        self.simulation.submit(self.soil_layer.crops.day_state(self.soil_layer.grid, tuple(self.player.pos)))
+
     # 重置机制
     def reset(self):
-        # plants
-        self.soil_layer.update_plants()
-        # soil
-        self.soil_layer.remove_water()
+        # plants and soil：取入夜时算好的结果，精灵在之后的模拟步里分批同步
+        if not self.simulation.submitted:
+            self.submit_day()
+        self.soil_layer.apply_day(self.simulation.take(), defer=self.simulation.threaded)
         # sky
         self.sky.start_color = [255, 255, 255]
         self.day_count += 1  # 天数增加
+        if self.autosave:
+            self.saves.autosave(self)
 
     def get_day(self):
         return self.day_count
 
+    # 读档：数值立即恢复，耕地和作物精灵在之后的模拟步里分批重建
+    def restore(self, snapshot):
+        if snapshot.grid.shape != self.soil_layer.grid.shape:
+            raise ValueError(f'save grid {snapshot.grid.shape} does not match the map {self.soil_layer.grid.shape}')
+        unknown = set(snapshot.crop_types) - set(CROPS)
+        if unknown:
+            raise ValueError(f'unknown crop types in save: {sorted(unknown)}')
+        self.day_count = snapshot.day
+        self.player.money = snapshot.money
+        self.player.item_inventory.update(snapshot.items)
+        self.player.seed_inventory.update(snapshot.seeds)
+        self.player.pos = Vector2(snapshot.position)
+        self.player.hitbox.center = (round(self.player.pos.x), round(self.player.pos.y))
+        self.player.rect.center = self.player.hitbox.center
+        self.achievement_system.achievements = list(snapshot.achievements)
+        self.achievement_system.harvest_count = snapshot.harvest_count
+        self.soil_layer.restore(snapshot.grid, snapshot.crop_cells, snapshot.crop_ages, snapshot.crop_types,
+                                self.player.pos)
+        self.all_sprites.save_positions()
+
     # 作物收获机制：
     def plant_collision(self):
         if self.soil_layer.plant_sprites:
-            for plant in self.soil_layer.plant_sprites.sprites():
+            for plant in self.soil_layer.plant_sprites.query(self.player.hitbox):
+                self.soil_layer.ensure_synced(plant)
                 if plant.harvestable and plant.rect.colliderect(self.player.hitbox):
-                    self.player_add(plant.plant_type)
-                    plant.kill()
-                    Particle(plant.rect.topleft, plant.image, self.all_sprites, z=LAYERS['main'])
-                    self.soil_layer.grid[plant.rect.centery // TILE_SIZE][plant.rect.centerx // TILE_SIZE].remove('P')
-                    self.achievement_system.add_harvest()  # 收获计数
+                    self.harvest(plant)
+
+    def harvest(self, plant):
+        self.player_add(plant.plant_type)
+        plant.kill()
+        if not self.headless:
+            self.particles.emit(plant.rect.topleft, plant.image, LAYERS['main'])
+        self.soil_layer.remove_plant(plant)
+        self.achievement_system.add_harvest()  # 收获计数
 
-    # 游戏运行
+    # 游戏运行：一次模拟加一次绘制（可变步长模式）
     def run(self, dt):
-        # 游戏暂停逻辑：小游戏期间只显示小游戏界面
+        self.update(dt)
+        return self.draw()
+
+    # 模拟一步：输入、移动、收获、天色和睡觉
+    def update(self, dt):
+        # 游戏暂停逻辑：小游戏期间世界不更新
         if self.mini_game_active:
-            self.display_surface.fill('black')
-            self.mini_game_update()
             return
-
-        # 界面绘制
-        self.display_surface.fill('black')
-        self.all_sprites.custom_draw(self.player)
+        if self.soil_layer.pending:
+            with profiler.section('soil_layer.build_pending'):
+                self.soil_layer.build_pending()
+        if self.soil_layer.stale or self.soil_layer.drying:
+            with profiler.section('soil_layer.sync_stale'):
+                self.soil_layer.sync_stale()
+        self.all_sprites.save_positions()
         # 商店和主页面区别更新
         if self.shop_active:
-            self.menu.update()
+            with profiler.section('menu.input'):
+                self.menu.input()
         else:
-            self.all_sprites.update(dt)
-            self.plant_collision()
+            with profiler.section('all_sprites.update'):
+                self.all_sprites.update(dt)
+            with profiler.section('plant_collision'):
+                self.plant_collision()
         # 天空
-        self.overlay.display()
-        self.sky.display(dt)
-        # 成就页面
-        self.achievement_system.display()
+        self.sky.update(dt)
         # 睡觉黑夜转换
         if self.player.sleep:
-            self.transition.play()
+            # 天变暗时就开始在后台算下一天
+            if self.transition.speed < 0 and not self.simulation.submitted:
+                self.submit_day()
+            with profiler.section('transition.play'):
+                self.transition.update()
             #小游戏
             if not self.mini_game_active and not self.mini_game_result:
                 self.mini_game_kill_plant()
@@ -952,7 +2547,83 @@ class Level:
             if self.mini_game_result and not self.mini_game_active:
                 self.player.sleep = False
                 self.mini_game_result = None
-                self.reset()
+                with profiler.section('reset'):
+                    self.reset()
+
+    # 绘制一帧，alpha 为两个模拟步之间的插值比例；返回要刷新到屏幕的区域，None 表示整屏
+    def draw(self, alpha=1.0):
+        # 性能 HUD 开关后整屏重画一次，关掉时不会把旧的 HUD 留在屏幕上
+        if profiler.hud_visible != self.hud_visible:
+            self.hud_visible = profiler.hud_visible
+            self.static_key = None
+        # 小游戏期间只显示小游戏界面
+        if self.mini_game_active:
+            with profiler.section('mini_game_update'):
+                return self.mini_game_update()
+        if self.dirty_rects and self.shop_active:
+            return self.draw_static()
+        self.static_key = None
+        self.draw_world(alpha)
+        self.draw_ui()
+        return None
+
+    def draw_world(self, alpha=1.0):
+        self.display_surface.fill('black')
+        with profiler.section('custom_draw'):
+            if self.static_layers and self.static_layers.streaming:
+                self.static_layers.stream(self.player.rect.center)
+            elif self.static_layers:
+                self.static_layers.bake()
+            self.all_sprites.custom_draw(self.player, alpha)
+
+    # 世界之上的界面：商店、覆盖层、调色和成就
+    def draw_ui(self):
+        if self.shop_active:
+            with profiler.section('menu.display'):
+                self.menu.display()
+        with profiler.section('overlay.display'):
+            self.overlay.display()
+        # 天色和黑夜过渡合成一次全屏调色
+        with profiler.section('tint.display'):
+            self.tint.display(*self.tints())
+        # 成就页面：天色不影响它，黑夜过渡只在画出来的弹窗和页面上补一次
+        with profiler.section('achievement_system.display'):
+            self.achievement_system.display()
+            if self.player.sleep:
+                self.tint.display_panels(self.achievement_system.panels(), self.transition.tint())
+
+    def tints(self):
+        if self.player.sleep:
+            return self.sky.start_color, self.transition.tint()
+        return self.sky.start_color,
+
+    def tint_key(self):
+        night = self.tint.resolve(self.transition.tint()) if self.player.sleep else None
+        return self.tint.resolve(*self.tints()), night
+
+    # 商店打开时世界不动：世界画面存成背景，之后只在状态变了的界面区域里
+    # 贴回背景、裁剪着重画界面；调色或覆盖层变了才整屏重画
+    def draw_static(self):
+        key = (self.tint_key(), self.day_count, self.player.selected_tool, self.player.selected_seed)
+        panels = {'menu': (self.menu.state(), self.menu.bounds()),
+                  'achievements': (self.achievement_system.state(), self.achievement_system.bounds())}
+        if key != self.static_key:
+            self.static_key = key
+            self.draw_world()
+            self.background = self.display_surface.copy()
+            self.draw_ui()
+            self.panels = panels
+            return None
+
+        dirty = [rect.union(self.panels[name][1]) for name, (state, rect) in panels.items()
+                 if state != self.panels[name][0]]
+        self.panels = panels
+        for rect in dirty:
+            self.display_surface.set_clip(rect)
+            self.display_surface.blit(self.background, rect, rect)
+            self.draw_ui()
+        self.display_surface.set_clip(None)
+        return dirty
 
     # 小游戏入口：启动小游戏
     def mini_game_kill_plant(self):
@@ -960,20 +2631,21 @@ class Level:
         if not alive_plants:
             return
         self.mini_game_active = True
-        self.mini_game_start_time = pygame.time.get_ticks()
+        self.mini_game_start_time = game_clock.ticks()
         self.mini_game_score = 0
         self.mini_game_round = 0
         self.mini_game_result = None
         self.mini_game_selected_plant = choice(alive_plants)
         self.mini_game_icon_visible = False
         self.mini_game_icon_flash_time = 0
-        self.mini_game_icon_surf = pygame.image.load(f'../graphics/fruit/{self.mini_game_selected_plant.plant_type}/0.png').convert_alpha()
+        self.mini_game_icon_surf = assets.image(f'../graphics/fruit/{self.mini_game_selected_plant.plant_type}/0.png')
         self.mini_game_icon_rect = None
         # 暂停背景音乐
-        self.music.stop()
-    # 小游戏主循环和绘制
+        if self.music:
+            self.music.stop()
+    # 小游戏主循环和绘制；脏矩形模式下画面没变就不重画，变了只刷新小游戏框和标题
     def mini_game_update(self):
-        now = pygame.time.get_ticks()
+        now = game_clock.ticks()
         elapsed = (now - self.mini_game_start_time) / 1000
         # 游戏结束
         if elapsed > 30 or self.mini_game_round >= 20:
@@ -988,22 +2660,14 @@ class Level:
                 # 杀死植物
                 self.mini_game_selected_plant.alive = False
                 self.mini_game_selected_plant.kill()
-                self.soil_layer.grid[self.mini_game_selected_plant.rect.centery // TILE_SIZE][self.mini_game_selected_plant.rect.centerx // TILE_SIZE].remove('P')
+                self.soil_layer.remove_plant(self.mini_game_selected_plant)
             # 恢复背景音乐
-            self.music.play(loops=-1)
-            return
+            if self.music:
+                self.music.play()
+            self.display_surface.fill('black')
+            return None
 
-        # 绘制小游戏界面
         mini_rect = pygame.Rect(SCREEN_WIDTH // 2 - 250, SCREEN_HEIGHT // 2 - 150, 500, 300)
-        pygame.draw.rect(self.display_surface, (255, 255, 220), mini_rect, border_radius=16)
-        font = pygame.font.Font('../font/ChangBanDianSong-12.ttf', 32)
-        title = font.render('女巫想杀死你的植物！点击作物救回！', True, 'red')
-        self.display_surface.blit(title, (SCREEN_WIDTH/4 , 20))
-        score_text = font.render(f'分数: {self.mini_game_score}/20', True, (0, 128, 0))
-        self.display_surface.blit(score_text, (mini_rect.x + 180, mini_rect.y + 70))
-        time_left = max(0, 30 - int(elapsed))
-        time_text = font.render(f'剩余时间: {time_left}s', True, (128, 0, 0))
-        self.display_surface.blit(time_text, (mini_rect.x + 160, mini_rect.y + 120))
         # 闪现逻辑，每次闪现持续0.7秒，间隔0.3秒
         if not self.mini_game_icon_visible:
             if self.mini_game_round < 20:
@@ -1019,60 +2683,454 @@ class Level:
             if now - self.mini_game_icon_flash_time > 900:
                 self.mini_game_icon_visible = False
                 self.mini_game_round += 1
+
+        time_left = max(0, 30 - int(elapsed))
+        state = (self.mini_game_score, self.mini_game_round, time_left, self.mini_game_icon_visible,
+                 tuple(self.mini_game_icon_rect) if self.mini_game_icon_rect else None)
+        title = text_cache.render('女巫想杀死你的植物！点击作物救回！', 'red', 32)
+        title_rect = title.get_rect(topleft=(SCREEN_WIDTH / 4, 20))
+        full = not self.dirty_rects or self.static_key != 'mini game'
+        if not full and state == self.mini_game_state:
+            return []
+        self.static_key = 'mini game'
+        self.mini_game_state = state
+        region = mini_rect.union(title_rect)
+        self.display_surface.fill('black', None if full else region)
+
+        # 绘制小游戏界面
+        pygame.draw.rect(self.display_surface, (255, 255, 220), mini_rect, border_radius=16)
+        self.display_surface.blit(title, title_rect)
+        score_text = text_cache.render(f'分数: {self.mini_game_score}/20', (0, 128, 0), 32)
+        self.display_surface.blit(score_text, (mini_rect.x + 180, mini_rect.y + 70))
+        time_text = text_cache.render(f'剩余时间: {time_left}s', (128, 0, 0), 32)
+        self.display_surface.blit(time_text, (mini_rect.x + 160, mini_rect.y + 120))
         # 显示图标
         if self.mini_game_icon_visible and self.mini_game_icon_rect:
             self.display_surface.blit(self.mini_game_icon_surf, self.mini_game_icon_rect)
         # 游戏结束提示
         if not self.mini_game_active and self.mini_game_result:
             result_text = '胜利！植物安全' if self.mini_game_result == 'win' else '失败，植物被杀死！'
-            result_surf = font.render(result_text, True, (255, 0, 0) if self.mini_game_result == 'lose' else (0, 128, 0))
+            result_surf = text_cache.render(result_text, (255, 0, 0) if self.mini_game_result == 'lose' else (0, 128, 0), 32)
             self.display_surface.blit(result_surf, (mini_rect.x + 140, mini_rect.y + 200))
+        return None if full else [region]
+
+
+# 静态图层烘焙：不会变化的瓦片预先画进分块表面------------------------------
+# 普通图层按 CHUNK_SIZE 见方分块；需要和玩家交错遮挡的图层（main）按
+# 瓦片行切成长条，长条的 centery 与原瓦片相同，排序结果不变
+class StaticChunk(pygame.sprite.Sprite):
+    def __init__(self, pos, size, z):
+        super().__init__()
+        self.rect = pygame.Rect(pos, size)
+        self.image = None  # 烘焙后才有表面，流式加载时卸载会释放
+        self.z = z
+        self.tiles = []  # (centery, 序号, 位置, 图像)
+        self.dirty = True
+        self.last_seen = 0
+        self.order = None  # 在相机组里的绘制先后，创建时定下，卸载后重新加入也不变
+
+    def bake(self):
+        if self.image is None:
+            self.image = pygame.Surface(self.rect.size, pygame.SRCALPHA)
+        self.image.fill((0, 0, 0, 0))
+        for _, __, pos, surf in sorted(self.tiles, key=lambda tile: tile[:2]):
+            if isinstance(surf, StreamedImage):
+                # 大图只取和本块重叠的部分
+                clip = self.rect.clip(surf.get_rect(topleft=pos))
+                region = surf.region(clip.move(-pos[0], -pos[1]))
+                self.image.blit(region, (clip.x - self.rect.x, clip.y - self.rect.y))
+            else:
+                self.image.blit(surf, (pos[0] - self.rect.x, pos[1] - self.rect.y))
+        self.dirty = False
+
+    def release(self):
+        self.image = None
+
+    def memory(self):
+        return self.image.get_pitch() * self.image.get_height() if self.image else 0
+
+
+# 不整张常驻内存的大图（如地面），按需从磁盘缓存里取一块区域
+class StreamedImage:
+    def __init__(self, path):
+        self.path = path
+        self.size = image_size(path)
+
+    def get_rect(self, **kwargs):
+        return pygame.Rect((0, 0), self.size).move(kwargs.get('topleft', (0, 0)))
+
+    def region(self, rect):
+        if assets.disk_cache:
+            try:
+                return assets.disk_cache.region(self.path, rect)
+            except (OSError, ValueError):
+                pass
+        return assets.load(self.path).subsurface(rect).copy()
+
+
+class StaticLayerBaker:
+    def __init__(self, all_sprites, chunk_size=CHUNK_SIZE, streaming=False):
+        self.all_sprites = all_sprites
+        self.chunk_size = chunk_size
+        self.chunks = {}  # (图层, 块列, 块行或瓦片行) -> StaticChunk
+        self.counter = 0
+        # 流式加载：只烘焙镜头附近的块，超出内存预算时卸载最久没看到的块
+        self.streaming = streaming
+        self.loaded = OrderedDict()  # 已烘焙的块，按最近看到的先后排列
+        self.memory = 0
+        self.frame = 0
+
+    def chunk_keys(self, rect, z):
+        cs = self.chunk_size
+        if z in Y_SORTED_LAYERS:
+            rows = range(rect.top // TILE_SIZE, (rect.bottom - 1) // TILE_SIZE + 1)
+        else:
+            rows = range(rect.top // cs, (rect.bottom - 1) // cs + 1)
+        for col in range(rect.left // cs, (rect.right - 1) // cs + 1):
+            for row in rows:
+                yield z, col, row
+
+    def get_chunk(self, key):
+        if key not in self.chunks:
+            z, col, row = key
+            if z in Y_SORTED_LAYERS:
+                pos, size = (col * self.chunk_size, row * TILE_SIZE), (self.chunk_size, TILE_SIZE)
+            else:
+                pos, size = (col * self.chunk_size, row * self.chunk_size), (self.chunk_size, self.chunk_size)
+            self.chunks[key] = StaticChunk(pos, size, z)
+            self.chunks[key].order = self.all_sprites.reserve()
+            if not self.streaming:
+                self.all_sprites.add(self.chunks[key])
+        return self.chunks[key]
+
+    def add(self, pos, surf, z=LAYERS['main']):
+        rect = surf.get_rect(topleft=pos)
+        for key in self.chunk_keys(rect, z):
+            chunk = self.get_chunk(key)
+            chunk.tiles.append((rect.centery, self.counter, pos, surf))
+            chunk.dirty = True
+        self.counter += 1
+
+    def remove(self, pos, surf, z=LAYERS['main']):
+        rect = surf.get_rect(topleft=pos)
+        for key in self.chunk_keys(rect, z):
+            chunk = self.chunks.get(key)
+            if not chunk:
+                continue
+            chunk.tiles = [tile for tile in chunk.tiles if tile[2] != pos]
+            chunk.dirty = True
+            if not chunk.tiles:
+                self.unload(chunk)
+                del self.chunks[key]
+
+    # 只重画有变化的分块，每帧绘制前调用
+    def bake(self):
+        for chunk in self.chunks.values():
+            if chunk.dirty:
+                chunk.bake()
+
+    # 流式模式下代替 bake：加载镜头附近（外扩 STREAM_MARGIN）的块，超预算时按最近最少看到卸载
+    def stream(self, center):
+        self.frame += 1
+        area = pygame.Rect(0, 0, SCREEN_WIDTH + STREAM_MARGIN * 2, SCREEN_HEIGHT + STREAM_MARGIN * 2)
+        area.center = center
+        for z in LAYERS.values():
+            for key in self.chunk_keys(area, z):
+                chunk = self.chunks.get(key)
+                if chunk:
+                    self.load(chunk)
+        while self.memory > STREAM_MEMORY_BUDGET:
+            chunk = next(iter(self.loaded))
+            if chunk.last_seen == self.frame:
+                break  # 剩下的都在镜头附近
+            self.unload(chunk)
+
+    def load(self, chunk):
+        chunk.last_seen = self.frame
+        if chunk in self.loaded:
+            self.loaded.move_to_end(chunk)
+            if not chunk.dirty:
+                return
+        self.memory -= chunk.memory()
+        chunk.bake()
+        self.memory += chunk.memory()
+        self.loaded[chunk] = None
+        if not chunk.alive():
+            self.all_sprites.add(chunk)
+
+    def unload(self, chunk):
+        if chunk in self.loaded:
+            del self.loaded[chunk]
+            self.memory -= chunk.memory()
+        chunk.kill()
+        if self.streaming:
+            chunk.release()
 
 
 # 相机功能：玩家显示在画面中心-----------------------------------------
+# 精灵按图层分桶，每个桶再按网格单元存放按 centery 有序的列表，
+# 绘制时只取与视口相交的单元做归并，不再对整张地图反复排序
 class CameraGroup(pygame.sprite.Group):
-    def __init__(self):
+    def __init__(self, cell_size=CAMERA_CELL_SIZE):
         super().__init__()
         self.display_surface = pygame.display.get_surface()
         self.offset = pygame.math.Vector2()
-
-    def custom_draw(self, player):
-        self.offset.x = player.rect.centerx - SCREEN_WIDTH / 2
-        self.offset.y = player.rect.centery - SCREEN_HEIGHT / 2
+        self.cell_size = cell_size
+        # 图层 -> {单元坐标: [(centery, 序号, 精灵)]}；比单元大的精灵（如地面）单独存放
+        self.cells = {layer: {} for layer in LAYERS.values()}
+        self.large = {layer: [] for layer in LAYERS.values()}
+        self.placement = {}  # 精灵 -> (图层, 单元坐标, 条目)
+        self.sequence = {}  # 精灵 -> 加入顺序，centery 相同时保持原来的先后
+        self.counter = 0
+        # 精灵加入组时往往还没有 rect，先挂起，绘制前再建索引
+        self.pending = {}
+        # 重写了 update 的精灵（玩家、粒子），只有它们需要每帧更新和重新定位
+        self.movers = {}
+        self.previous = {}  # 精灵 -> 上一个模拟步的中心点
+        self.blit_count = 0
+
+    def add_internal(self, sprite, layer=None):
+        super().add_internal(sprite, layer)
+        order = getattr(sprite, 'order', None)
+        self.sequence[sprite] = self.reserve() if order is None else order
+        self.pending[sprite] = None
+        if type(sprite).update is not pygame.sprite.Sprite.update:
+            self.movers[sprite] = None
+
+    def remove_internal(self, sprite):
+        super().remove_internal(sprite)
+        self.pending.pop(sprite, None)
+        self.movers.pop(sprite, None)
+        self.previous.pop(sprite, None)  # 池里的精灵再加入时不能从旧位置插值
+        self.unindex(sprite)
+        del self.sequence[sprite]
+
+    # 预留一个加入顺序：精灵先占好位置，之后什么时候加入都排在同一处
+    def reserve(self):
+        self.counter += 1
+        return self.counter - 1
+
+    def update(self, *args, **kwargs):
+        for sprite in tuple(self.movers):
+            sprite.update(*args, **kwargs)
+
+    # 每个模拟步开始前记下会动的精灵的位置，绘制时在两步之间插值
+    def save_positions(self):
+        self.previous = {sprite: sprite.rect.center for sprite in self.movers}
+
+    def interpolated_center(self, sprite, alpha):
+        previous = self.previous.get(sprite)
+        if previous is None or alpha >= 1:
+            return sprite.rect.center
+        x, y = sprite.rect.center
+        return previous[0] + (x - previous[0]) * alpha, previous[1] + (y - previous[1]) * alpha
+
+    def cell_key(self, rect):
+        if rect.width > self.cell_size or rect.height > self.cell_size:
+            return None
+        return rect.left // self.cell_size, rect.top // self.cell_size
+
+    def index(self, sprite):
+        key = self.cell_key(sprite.rect)
+        if key is None:
+            bucket = self.large.setdefault(sprite.z, [])
+        else:
+            bucket = self.cells.setdefault(sprite.z, {}).setdefault(key, [])
+        entry = (sprite.rect.centery, self.sequence[sprite], sprite)
+        insort(bucket, entry)
+        self.placement[sprite] = (sprite.z, key, entry)
+
+    def unindex(self, sprite):
+        placed = self.placement.pop(sprite, None)
+        if placed is None:
+            return
+        z, key, entry = placed
+        bucket = self.large[z] if key is None else self.cells[z][key]
+        del bucket[bisect_left(bucket, entry)]
+        if key is not None and not bucket:
+            del self.cells[z][key]
+
+    # 精灵位置、大小或图层变化后调用，只移动这一个条目
+    def refresh(self, sprite):
+        placed = self.placement.get(sprite)
+        if placed is None:
+            return
+        z, key, entry = placed
+        if z == sprite.z and entry[0] == sprite.rect.centery and key == self.cell_key(sprite.rect):
+            return
+        self.unindex(sprite)
+        self.index(sprite)
+
+    def visible_sprites(self, layer, view):
+        cells = self.cells.get(layer, {})
+        cs = self.cell_size
+        # 单元按左上角归属，精灵不超过一个单元，所以向左、向上多取一格
+        buckets = [cells[(cx, cy)]
+                   for cy in range(view.top // cs - 1, view.bottom // cs + 1)
+                   for cx in range(view.left // cs - 1, view.right // cs + 1)
+                   if (cx, cy) in cells]
+        large = self.large.get(layer)
+        if large:
+            buckets.append(large)
+        for _, __, sprite in heapq.merge(*buckets):
+            if sprite.rect.colliderect(view):
+                yield sprite
+
+    def custom_draw(self, player, alpha=1.0):
+        center = self.interpolated_center(player, alpha)
+        self.offset.x = center[0] - SCREEN_WIDTH / 2
+        self.offset.y = center[1] - SCREEN_HEIGHT / 2
+        for sprite in tuple(self.pending):
+            del self.pending[sprite]
+            self.index(sprite)
+        for sprite in self.movers:
+            self.refresh(sprite)
+
+        view = pygame.Rect(int(self.offset.x), int(self.offset.y), SCREEN_WIDTH, SCREEN_HEIGHT)
+        self.blit_count = 0
         for layer in LAYERS.values():
-            for sprite in sorted(self.sprites(), key=lambda sprite: sprite.rect.centery):
-                if sprite.z == layer:
-                    offset_rect = sprite.rect.copy()
-                    offset_rect.center -= self.offset
-                    self.display_surface.blit(sprite.image, offset_rect)
+            for sprite in self.visible_sprites(layer, view):
+                offset_rect = sprite.rect.copy()
+                if sprite in self.previous:
+                    offset_rect.center = self.interpolated_center(sprite, alpha)
+                offset_rect.center -= self.offset
+                self.display_surface.blit(sprite.image, offset_rect)
+                self.blit_count += 1
+
 
 # 游戏主体--------------------------------------------------------
 class Game:
-    def __init__(self):
+    # record：把每帧输入录到文件；replay：回放录像（从新档开始，不读写存档）
+    def __init__(self, record=None, replay=None):
         pygame.init()
-        self.screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
+        if VSYNC:
+            self.screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT), pygame.SCALED, vsync=1)
+        else:
+            self.screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
         pygame.display.set_caption('小猫岛')
         self.clock = pygame.time.Clock()
+        self.replay = InputReplay(replay) if replay else None
+        seed = self.replay.seed if self.replay else int.from_bytes(os.urandom(4), 'little')
+        random.seed(seed)
+        self.recorder = InputRecorder(record, seed) if record else None
+        self.persist = not (record or replay)
         self.level = Level()
+        if LOAD_SAVE and self.persist and not self.load_save():
+            self.level = Level()  # 读不了的存档不管，从新档开始，下次存档时覆盖
+        self.level.autosave = self.level.autosave and self.persist
+        if self.replay:
+            # 回放时记录整段的每帧耗时
+            profiler.enabled = True
+            profiler.frames = deque()
+
+    # 读档；存档损坏、版本不对、和地图或作物表对不上时返回 False
+    def load_save(self):
+        try:
+            snapshot = self.level.saves.load()
+            if snapshot:
+                self.level.restore(snapshot)
+        except (OSError, ValueError, KeyError, struct.error, zlib.error):
+            return False
+        return True
+
+    # 处理窗口事件，返回本帧的鼠标左键点击位置
+    def handle_events(self):
+        clicks = []
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                self.quit()
+            if event.type == pygame.MOUSEBUTTONDOWN and event.button == 1:
+                clicks.append(event.pos)
+            # 性能分析 HUD 与导出
+            if event.type == pygame.KEYDOWN and event.key == pygame.K_F3:
+                profiler.toggle_hud()
+            if event.type == pygame.KEYDOWN and event.key == pygame.K_F4 and profiler.frames:
+                profiler.export()
+        return clicks
+
+    # 一帧的输入和 dt：实时（可录制）或者来自录像
+    # 限帧等待在帧开始之前，不算进帧耗时
+    def next_frame(self):
+        if not self.replay:
+            dt = self.clock.tick(FRAME_CAP) / 1000
+        profiler.begin_frame()
+        clicks = self.handle_events()
+        if self.replay:
+            dt = self.replay.read(controls)
+            if dt is None:
+                self.finish_replay()
+        else:
+            controls.poll(clicks)
+            if self.recorder:
+                self.recorder.write(dt, controls)
+        for pos in controls.clicks:
+            self.click(pos)
+        return dt
+
+    def click(self, pos):
+        self.level.achievement_system.click(pos)  # 处理成就按钮点击
+        # 小游戏点击判定
+        if self.level.mini_game_active:
+            if self.level.mini_game_icon_visible and self.level.mini_game_icon_rect and self.level.mini_game_icon_rect.collidepoint(pos):
+                self.level.mini_game_score += 1
+                self.level.mini_game_icon_visible = False
+                self.level.mini_game_round += 1
+
+    def quit(self):
+        if self.recorder:
+            self.recorder.close()
+        if self.persist:
+            self.level.saves.save(self.level)
+        pygame.quit()
+        sys.exit()
+
+    # 回放结束：输出帧耗时和最终状态的摘要，不同版本跑同一段录像可以直接对比
+    def finish_replay(self):
+        p50, p95, p99 = profiler.percentiles(0.5, 0.95, 0.99)
+        state = hashlib.sha1(encode_save(self.level.saves.snapshot(self.level))).hexdigest()
+        print(f'replayed {self.replay.frame} frames  p50 {p50:.2f}  p95 {p95:.2f}  p99 {p99:.2f} ms')
+        print(f'final state {state}  day {self.level.day_count}  money {self.level.player.money}')
+        profiler.export()
+        self.quit()
 
     def run(self):
+        if FIXED_TIMESTEP:
+            return self.run_fixed()
+        while True:
+            dt = self.next_frame()
+            game_clock.advance(dt)
+            self.present(self.level.run(dt))
+
+    # 固定步长：模拟按 TICK_RATE 推进，绘制按 FRAME_CAP 限帧并在两步之间插值；
+    # 机器跟不上时先补模拟步、少画几帧，一帧最多补 MAX_FRAME_SKIP 步，剩下的时间直接丢掉
+    def run_fixed(self):
+        step = 1 / TICK_RATE
+        accumulator = 0.0
         while True:
-            for event in pygame.event.get():
-                if event.type == pygame.QUIT:
-                    pygame.quit()
-                    sys.exit()
-                self.level.achievement_system.handle_event(event)  # 处理成就按钮点击
-            # 小游戏点击判定
-                if self.level.mini_game_active and event.type == pygame.MOUSEBUTTONDOWN and event.button == 1:
-                    if self.level.mini_game_icon_visible and self.level.mini_game_icon_rect and self.level.mini_game_icon_rect.collidepoint(event.pos):
-                        self.level.mini_game_score += 1
-                        self.level.mini_game_icon_visible = False
-                        self.level.mini_game_round += 1
-            dt = self.clock.tick() / 1000
-            self.level.run(dt)
-            pygame.display.update()
+            accumulator += min(self.next_frame(), step * MAX_FRAME_SKIP)
+            while accumulator >= step:
+                game_clock.advance(step)
+                self.level.update(step)
+                accumulator -= step
+            self.present(self.level.draw(accumulator / step))
+
+    # dirty 为 None 时刷新整屏，否则只刷新这些区域（空列表就什么都不刷新）
+    def present(self, dirty=None):
+        profiler.display(self.screen)
+        with profiler.section('display.update'):
+            if dirty is None or profiler.hud_visible:
+                pygame.display.update()
+            elif dirty:
+                pygame.display.update(dirty)
+        profiler.end_frame(len(self.level.all_sprites), self.level.all_sprites.blit_count)
+
+
 # 运行-----------------------------------------------------------------
 if __name__ == '__main__':
-    game = Game()
+    parser = argparse.ArgumentParser(description='小猫岛')
+    parser.add_argument('--record', help='把每帧的输入录到这个文件')
+    parser.add_argument('--replay', help='回放录像，结束后输出帧耗时和最终状态')
+    args = parser.parse_args()
+    game = Game(args.record, args.replay)
     game.run()
 
@@ -0,0 +1,33 @@
+# 离线构建工具：在 code 目录下运行 python tools.py <命令>
+import os
+import sys
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+
+import pygame
+
+from test import *
+
+
+# 预编译地图：map.tmx -> map.bin
+def build_map():
+    compile_map(MAP_PATH)
+    print(f'wrote {compiled_map_path(MAP_PATH)} ({os.path.getsize(compiled_map_path(MAP_PATH))} bytes)')
+
+
+# 打包图集：角色、耕地、水、作物和覆盖层的小图 -> graphics/atlas
+def build_atlas():
+    pages, count = pack_atlas()
+    print(f'packed {count} images into {len(pages)} pages in {ATLAS_DIR}')
+
+
+COMMANDS = {
+    'compile-map': build_map,
+    'build-atlas': build_atlas,
+}
+
+if __name__ == '__main__':
+    pygame.init()
+    pygame.display.set_mode((1, 1))
+    for name in sys.argv[1:] or COMMANDS:
+        COMMANDS[name]()